@@ -16,6 +16,12 @@ Usage:
 
 Where options are:
 
+  --clean           remove redundant commands from the result
+  --compact         leave out unchanged words to reduce the file size
+  --dedupe          remove cuts that repeat (or overlap) earlier cuts
+  --linearise tol   replace arcs with straight moves (tolerance in mm)
+  --simplify tol    remove points from runs of short moves (tolerance in mm)
+  --fit-arcs tol    replace runs of short moves with arcs (tolerance in mm)
   --image           generate an image of the result
   --output filename the name of the file to write the results to
 """
@@ -25,6 +31,12 @@ if __name__ == "__main__":
   parser = OptionParser()
   parser.add_option("-o", "--output", action="store", type="string", dest="output")
   parser.add_option("-i", "--image", action="store_true", dest="image", default=False)
+  parser.add_option("--clean", action="store_true", dest="clean", default=False)
+  parser.add_option("--compact", action="store_true", dest="compact", default=False)
+  parser.add_option("--dedupe", action="store_true", dest="dedupe", default=False)
+  parser.add_option("--linearise", action="store", type="float", dest="linearise")
+  parser.add_option("--simplify", action="store", type="float", dest="simplify")
+  parser.add_option("--fit-arcs", action="store", type="float", dest="fit_arcs")
   options, args = parser.parse_args()
   # Check positional arguments
   if len(args) < 1:
@@ -42,8 +54,21 @@ if __name__ == "__main__":
   for filename in args:
     source = loadGCode(filename, BoxedLoader(start = GCommand("G00 X0 Y0"), end = GCommand("M02"), inclusive = False))
     gcode.append(source)
+  if options.linearise is not None:
+    gcode = gcode.clone(LineariseArc(options.linearise))
+  if options.simplify is not None:
+    gcode = gcode.clone(Simplify(options.simplify))
+  if options.fit_arcs is not None:
+    gcode = gcode.clone(FitArc(options.fit_arcs))
+  if options.dedupe:
+    gcode = gcode.clone(RemoveDuplicate())
+  if options.clean:
+    gcode = gcode.clone(RemoveRedundant())
   # Save the output
-  saveGCode(options.output, gcode, prefix = settings['prefix'], suffix = settings['suffix'])
+  writer = None
+  if options.compact:
+    writer = CompactWriter(axes = settings.get('precision'))
+  saveGCode(options.output, gcode, prefix = settings['prefix'], suffix = settings['suffix'], writer = writer)
   print "Generated - %s" % str(gcode)
   if options.image:
     gcode.render(splitext(options.output)[0] + ".png")
@@ -25,10 +25,15 @@
 #
 # Tool to pack multiple PCB g-code files into a single panel.
 #----------------------------------------------------------------------------
-import re
+import numpy as np
 from util import *
+from copy import copy
+from hashlib import md5
+from multiprocessing import Pool, cpu_count
+from math import ceil, floor, exp
 from string import Template
-from random import randint
+from random import randint, random, choice
+from time import time
 from os import listdir
 from os.path import realpath, splitext, exists, join, basename
 from optparse import OptionParser
@@ -64,6 +69,27 @@ OPENSCAM_XML = """
 </openscam>
 """
 
+#--- Subprogram syntax for each controller dialect (used with --repeat)
+SUBPROGRAMS = {
+  # LinuxCNC O-word subroutines, these must be defined before they are called
+  "linuxcnc": {
+    "start": "o%(number)d sub",
+    "end": "o%(number)d endsub",
+    "call": "o%(number)d call",
+    "before": True,
+    },
+  # Fanuc style (Mach3 and others), these follow the end of the main program
+  "fanuc": {
+    "start": "O%(number)d",
+    "end": "M99",
+    "call": "M98 P%(number)d",
+    "before": False,
+    },
+  }
+
+#--- First subprogram number to use
+SUBPROGRAM_BASE = 100
+
 #----------------------------------------------------------------------------
 # Helper functions
 #----------------------------------------------------------------------------
@@ -75,19 +101,6 @@ def area(*args):
   """
   return sum([ float(a.w) * float(a.h) for a in args ])
 
-def rotations(boards):
-  """ Generator to walk through all rotation combinations
-  """
-  for iteration in range(2 ** len(boards)):
-    candidate = list()
-    flag = 1
-    for index in range(len(boards)):
-      board = boards[index].clone()
-      if iteration & flag:
-        board.rotated = True
-      candidate.append(board)
-    yield sorted(candidate, cmp = lambda x, y: cmp(x.h, y.h), reverse = True)
-
 def findFile(path, filename):
   """ Find a file that ends with the given filename in the path
 
@@ -101,54 +114,6 @@ def findFile(path, filename):
     return None
   return join(path, result[0])
 
-def loadDrillFile(filename):
-  """ Load an Excellon format drill file
-
-    Returns a dictionary of lists mapping drill diameters to a list of X/Y
-    positions (in mm). This is geared towards the files generated by
-    DesignSpark.
-  """
-  global options
-  header = True
-  current = None
-  tools = dict()
-  results = dict()
-  divisor = None
-  scale = 25.4
-  regex = re.compile("X([0-9]*)Y([0-9]*)")
-  for line in open(filename, "r"):
-    line = line.strip()
-    if header:
-      # Look for tool definitions (eg "T1C00.039")
-      if line.startswith("T"):
-        tools[line[1]] = round(scale * float(line[3:]), 1)
-        # Figure out the divisor
-        if divisor is None:
-          divisor = 10.0 ** len(line[3:].split(".")[1])
-        if options.merge:
-          # Merge any bit <= 1.2mm into a single 1mm group
-          if tools[line[1]] <= 1.2:
-            tools[line[1]] = 1.0
-      elif line.startswith("METRIC"):
-        scale = 1.0
-      elif line.startswith("%"):
-        header = False
-    else:
-      if line.startswith("T"):
-        # Tool selection
-        current = tools[line[3]]
-        if not results.has_key(current):
-          results[current] = list()
-      elif line.startswith("X"):
-        # Position
-        if current is not None:
-          parts = regex.match(line).groups()
-          if len(parts) == 2:
-            x = scale * (int(parts[0], 10) / divisor)
-            y = scale * (int(parts[1], 10) / divisor)
-            results[current].append((x, y))
-  return results
-
 #----------------------------------------------------------------------------
 # Manage board positioning
 #
@@ -169,6 +134,8 @@ class BoardPosition:
     self.name = name
     self._width = w
     self._height = h
+    self.shape = None
+    self.clearance = 0.0
     self.reset()
 
   def __str__(self):
@@ -227,10 +194,23 @@ class BoardPosition:
     """
     return self.width * self.height
 
+  def toJSON(self):
+    return {
+      "name": self.name,
+      "width": self._width,
+      "height": self._height,
+      "x": self.x,
+      "y": self.y,
+      "rotated": self.rotated,
+      }
+
   def clone(self):
-    copy = BoardPosition(self.name, self.w, self.h)
+    copy = BoardPosition(self.name, self._width, self._height)
     copy.x = self.x
     copy.y = self.y
+    copy.rotated = self.rotated
+    copy.shape = self.shape
+    copy.clearance = self.clearance
     return copy
 
 #----------------------------------------------------------------------------
@@ -248,13 +228,17 @@ class PCB:
 
       Verify that all the files needed exist and load them
     """
-    global CONFIG, CONTROL
+    global CONFIG, CONTROL, options
     path = join(realpath(CONFIG['boards']), name)
     if not exists(path):
       raise Exception("No board directory found at '%s'" % path)
     # Set up basics
     self.name = name
     self.padding = 2.0 # TODO: Should be in config
+    if options.common_line:
+      # Boards are placed edge to edge so they can share outline cuts
+      self.padding = 0.0
+    self._rotated = dict()
     # Load the board outline
     filename = findFile(path, "Board Outline_EDGEMILL_GCODE.ngc")
     if filename is None:
@@ -266,9 +250,13 @@ class PCB:
     self.outline = self.outline.clone(Flip(xflip = self.midpoint), Translate(self.dx, self.dy))
     # Generate the drill gcode from the excellon data
     self.drills = dict()
+    drills = None
     filename = findFile(path, "Drill Data - [Through Hole].drl")
     if filename is not None:
-      drills = loadDrillFile(filename)
+      drills = loadExcellon(filename)
+      if options.merge:
+        # Merge any bit <= 1.2mm into a single 1mm group
+        drills = mergeDrills(drills, 1.2, 1.0)
       # Generate the gcode
       for diam in drills.keys():
         gcd = GCode()
@@ -291,13 +279,11 @@ class PCB:
       raise Exception("Missing bottom copper for '%s'" % name)
     self.bottom = loadGCode(filename, BoxedLoader(start = GCommand("G04 P1"), end = GCommand("G00 X0 Y0"), inclusive = False))
     # Add outlines for the drill holes (avoid tearing)
-    global options
     if options.pads:
       if drills is not None:
         for diam in drills.keys():
           if diam >= 1.0: # Holes < 1.0 mm don't need the outline
-            for x, y in drills[diam]:
-              self.bottom.circle(x, y, (diam - CONFIG['toolwidth']) / 2, self.bottom.minz, self.bottom.maxz, step = 0.254)
+            self.bottom.circles(drills[diam], (diam - CONFIG['toolwidth']) / 2, self.bottom.minz, self.bottom.maxz, step = 0.254)
     self.bottom = self.bottom.clone(Flip(xflip = self.midpoint), Translate(self.dx, self.dy))
     # Generate an outline as well (to avoid tearing)
     delta = abs(max(self.dx, self.dy)) / 2
@@ -321,10 +307,74 @@ class PCB:
     """
     return gcode.clone(Rotate(-90.0), Translate(0.0, self.outline.maxx))
 
+  def _layer(self, gcode, key, rotated):
+    """ Get a layer in the orientation needed for a placement
+
+      Rotated layers are cached so boards that are placed multiple times only
+      need to be rotated once.
+    """
+    if not rotated:
+      return gcode
+    result = self._rotated.get(key, None)
+    if result is None:
+      result = self._rotate(gcode)
+      self._rotated[key] = result
+    return result
+
+  def getShape(self):
+    """ Return the board outline as a list of polygons
+
+      The points are relative to the bottom left corner of the board
+      (including padding).
+    """
+    polygons = list()
+    current = list()
+    x, y, z = 0.0, 0.0, 0.0
+    for cmd in self.outline.clone(LineariseArc(0.05)).lines:
+      if cmd.X is not None:
+        x = cmd.X
+      if cmd.Y is not None:
+        y = cmd.Y
+      if cmd.Z is not None:
+        z = cmd.Z
+      if z < 0.0:
+        if len(current) == 0:
+          current.append((x + self.padding, y + self.padding))
+        elif cmd.command in ("G01", "G02", "G03"):
+          current.append((x + self.padding, y + self.padding))
+      elif len(current) > 0:
+        polygons.append(current)
+        current = list()
+    if len(current) > 0:
+      polygons.append(current)
+    return [ p for p in polygons if len(p) > 2 ]
+
   def getBoard(self):
     """ Return a BoardPosition for this PCB
     """
-    return BoardPosition(self.name, self.outline.maxx + (2 * self.padding), self.outline.maxy + (2 * self.padding))
+    global CONFIG
+    board = BoardPosition(self.name, self.outline.maxx + (2 * self.padding), self.outline.maxy + (2 * self.padding))
+    # The outline is the centre of the cut, allow for the tool width
+    board.shape = self.getShape()
+    board.clearance = self.padding + (CONFIG['toolwidth'] / 2)
+    return board
+
+  def getLayer(self, key, rotated):
+    """ Get a single layer in the orientation needed for a placement
+
+      The key is "bottom", "outline" or ("drill", diameter). Returns None if
+      the board doesn't have the layer.
+    """
+    gcode = None
+    if key == "bottom":
+      gcode = self.bottom
+    elif key == "outline":
+      gcode = self.outline
+    elif key[0] == "drill":
+      gcode = self.drills.get(key[1], None)
+    if gcode is None:
+      return None
+    return self._layer(gcode, key, rotated)
 
   def generateTopCopper(self, gcode, position, panel_height):
     # TODO: This is harder than it looks :(
@@ -333,44 +383,308 @@ class PCB:
   def generateBottomCopper(self, gcode, position):
     if self.bottom is None:
       return
-    bottom = self.bottom
-    # Rotate if needed
-    if position.rotated:
-      bottom = self._rotate(bottom)
-    # Translate to the right spot
-    bottom = bottom.clone(Translate(self.padding + position.x, self.padding + position.y))
-    # Add to the full gcode
+    bottom = self._layer(self.bottom, "bottom", position.rotated)
+    # Add to the full gcode (translated to the right spot)
     gcode.append("(INFO: %s @ %04.f, %0.4f rot = %s)" % (self.name, position.x, position.y, position.rotated))
-    gcode.append(bottom)
+    gcode.appendOffset(bottom, self.padding + position.x, self.padding + position.y)
 
   def generateOutline(self, gcode, position):
     """ Generate the board outline gcode given the position
     """
-    outline = self.outline
-    # Rotate if needed
-    if position.rotated:
-      outline = self._rotate(outline)
-    # Translate to the right spot
-    outline = outline.clone(Translate(self.padding + position.x, self.padding + position.y))
-    # Add to the full gcode
+    outline = self._layer(self.outline, "outline", position.rotated)
+    # Add to the full gcode (translated to the right spot)
     gcode.append("(INFO: %s @ %04.f, %0.4f rot = %s)" % (self.name, position.x, position.y, position.rotated))
-    gcode.append(outline)
+    gcode.appendOffset(outline, self.padding + position.x, self.padding + position.y)
 
   def generateDrills(self, drills, position):
     """ Generate the drill files for various diameters
     """
     for diam in self.drills.keys():
-      drill = self.drills[diam]
-      # Rotate if needed
-      if position.rotated:
-        drill = self._rotate(drill)
-      # Translate to the right spot
-      drill = drill.clone(Translate(self.padding + position.x, self.padding + position.y))
-      # Add to the full gcode
+      drill = self._layer(self.drills[diam], ("drill", diam), position.rotated)
+      # Add to the full gcode (translated to the right spot)
       if not drills.has_key(diam):
         drills[diam] = GCode()
       drills[diam].append("(INFO: %s @ %04.f, %0.4f rot = %s)" % (self.name, position.x, position.y, position.rotated))
-      drills[diam].append(drill)
+      drills[diam].appendOffset(drill, self.padding + position.x, self.padding + position.y)
+
+#----------------------------------------------------------------------------
+# Placement engines
+#
+# An engine places boards on a panel one at a time, keeping track of the
+# space that is still available. Boards are positioned as close to the
+# origin as possible (lowest X first, then lowest Y).
+#----------------------------------------------------------------------------
+
+class Packer:
+  """ Base class for placement engines
+  """
+
+  def __init__(self, panel):
+    self.panel = panel
+    self.placed = list(panel.locked)
+
+  def clone(self):
+    """ Create a copy of the engine (and the current placements)
+    """
+    result = copy(self)
+    result.placed = list(self.placed)
+    return result
+
+  def reserve(self, board):
+    """ Mark the area used by an already positioned board
+    """
+    self.placed.append(board)
+
+  def place(self, board):
+    """ Find a position for the board
+
+      Returns True (and updates the board position) if the board was placed.
+    """
+    return False
+
+class GridPacker(Packer):
+  """ Test every whole millimetre position on the panel
+  """
+
+  def place(self, board):
+    if self.panel.findPosition(self.placed, board):
+      self.placed.append(board)
+      return True
+    return False
+
+class MaxRectsPacker(Packer):
+  """ Maintain a list of the maximal free rectangles on the panel
+
+    Boards can be placed at any position (not just whole millimetres) and the
+    panel padding is respected.
+  """
+
+  # Allowance for rounding errors
+  EPSILON = 1e-6
+
+  def __init__(self, panel):
+    Packer.__init__(self, panel)
+    padding = panel.padding
+    self.free = [ (padding, padding, panel.w - (2 * padding), panel.h - (2 * padding)) ]
+    for lock in panel.locked:
+      self._split(lock.x, lock.y, lock.w, lock.h)
+
+  def _split(self, x, y, w, h):
+    """ Remove the given area from the free rectangles
+    """
+    results = list()
+    for rect in self.free:
+      fx, fy, fw, fh = rect
+      if (x >= (fx + fw)) or ((x + w) <= fx) or (y >= (fy + fh)) or ((y + h) <= fy):
+        results.append(rect)
+        continue
+      # Keep the parts of the rectangle around the used area
+      if x > fx:
+        results.append((fx, fy, x - fx, fh))
+      if (x + w) < (fx + fw):
+        results.append((x + w, fy, (fx + fw) - (x + w), fh))
+      if y > fy:
+        results.append((fx, fy, fw, y - fy))
+      if (y + h) < (fy + fh):
+        results.append((fx, y + h, fw, (fy + fh) - (y + h)))
+    # Drop any rectangles contained by another
+    self.free = list()
+    for index in range(len(results)):
+      fx, fy, fw, fh = results[index]
+      contained = False
+      for other in range(len(results)):
+        if other == index:
+          continue
+        ox, oy, ow, oh = results[other]
+        if (ox <= fx) and (oy <= fy) and ((ox + ow) >= (fx + fw)) and ((oy + oh) >= (fy + fh)):
+          # Only one of a pair of identical rectangles is kept
+          if (results[other] <> results[index]) or (other < index):
+            contained = True
+            break
+      if not contained:
+        self.free.append(results[index])
+
+  def clone(self):
+    result = Packer.clone(self)
+    result.free = list(self.free)
+    return result
+
+  def reserve(self, board):
+    self._split(board.x, board.y, board.w, board.h)
+    Packer.reserve(self, board)
+
+  def place(self, board):
+    best = None
+    for fx, fy, fw, fh in self.free:
+      if (board.w <= (fw + MaxRectsPacker.EPSILON)) and (board.h <= (fh + MaxRectsPacker.EPSILON)):
+        if (best is None) or ((fx, fy) < best):
+          best = (fx, fy)
+    if best is None:
+      return False
+    board.x, board.y = best
+    self._split(board.x, board.y, board.w, board.h)
+    self.placed.append(board)
+    return True
+
+class BitmapPacker(Packer):
+  """ Track the used area of the panel as a bitmap
+
+    The panel is divided into square cells (the size is set by the panel
+    resolution). A summed area table of the bitmap allows every possible
+    position for a board to be tested in a single pass. Boards are rounded up
+    to a whole number of cells.
+  """
+
+  # Allowance for rounding errors
+  EPSILON = 1e-6
+
+  def __init__(self, panel):
+    Packer.__init__(self, panel)
+    self.resolution = panel.resolution
+    self.used = np.ones((self._cells(panel.h), self._cells(panel.w)), dtype = bool)
+    # Mark the area inside the padding as available
+    first = int(ceil((panel.padding / self.resolution) - BitmapPacker.EPSILON))
+    self.used[first:int(floor(((panel.h - panel.padding) / self.resolution) + BitmapPacker.EPSILON)), first:int(floor(((panel.w - panel.padding) / self.resolution) + BitmapPacker.EPSILON))] = False
+    for lock in panel.locked:
+      self._mark(lock.x, lock.y, lock.w, lock.h)
+    self._update()
+
+  def _cells(self, size):
+    """ Number of cells needed to cover the given size
+    """
+    return int(ceil((size / self.resolution) - BitmapPacker.EPSILON))
+
+  def _mark(self, x, y, w, h):
+    """ Mark an area (in mm) as used
+    """
+    x1, y1 = int(floor(x / self.resolution)), int(floor(y / self.resolution))
+    x2, y2 = self._cells(x + w), self._cells(y + h)
+    self.used[max(0, y1):max(0, y2), max(0, x1):max(0, x2)] = True
+
+  def _update(self):
+    """ Rebuild the summed area table
+    """
+    self.table = np.zeros((self.used.shape[0] + 1, self.used.shape[1] + 1), dtype = np.int32)
+    self.table[1:, 1:] = self.used.cumsum(axis = 0).cumsum(axis = 1)
+
+  def clone(self):
+    result = Packer.clone(self)
+    result.used = self.used.copy()
+    return result
+
+  def reserve(self, board):
+    self._mark(board.x, board.y, board.w, board.h)
+    self._update()
+    Packer.reserve(self, board)
+
+  def place(self, board):
+    w, h = self._cells(board.w), self._cells(board.h)
+    rows, cols = self.used.shape
+    if (w > cols) or (h > rows):
+      return False
+    # Sum of used cells for every possible position of the board
+    table = self.table
+    used = table[h:, w:] - table[:rows - h + 1, w:] - table[h:, :cols - w + 1] + table[:rows - h + 1, :cols - w + 1]
+    free = used == 0
+    columns = free.any(axis = 0)
+    if not columns.any():
+      return False
+    col = int(np.argmax(columns))
+    row = int(np.argmax(free[:, col]))
+    board.x, board.y = col * self.resolution, row * self.resolution
+    self.used[row:row + h, col:col + w] = True
+    self._update()
+    self.placed.append(board)
+    return True
+
+def dilate(mask, cells):
+  """ Grow the set areas of a boolean array by the given number of cells
+  """
+  if cells <= 0:
+    return mask
+  rows, cols = mask.shape
+  size = (2 * cells) + 1
+  table = np.zeros((rows + size, cols + size), dtype = np.int32)
+  table[cells + 1:rows + cells + 1, cells + 1:cols + cells + 1] = mask
+  table = table.cumsum(axis = 0).cumsum(axis = 1)
+  counts = table[size:, size:] - table[:rows, size:] - table[size:, :cols] + table[:rows, :cols]
+  return counts > 0
+
+# Rasterised board outlines, keyed by (name, rotated, resolution)
+FOOTPRINTS = dict()
+
+class NestPacker(BitmapPacker):
+  """ Place boards using their actual outline rather than the bounding box
+
+    Each board outline is rasterised (and grown by the board clearance) on the
+    same grid as the panel. The overlap between the board and the used area
+    at every position is calculated in one pass with an FFT based correlation.
+    Boards without an outline are treated as rectangles.
+  """
+
+  def _footprint(self, board):
+    """ Get the cells covered by the board
+    """
+    global FOOTPRINTS
+    key = (board.name, board.rotated, self.resolution)
+    footprint = FOOTPRINTS.get(key, None)
+    if footprint is None:
+      w, h = board._width, board._height
+      if board.rotated:
+        w, h = h, w
+      footprint = np.ones((self._cells(h), self._cells(w)), dtype = bool)
+      if board.shape:
+        img = Image.new("1", (self._cells(board._width), self._cells(board._height)), 0)
+        drw = ImageDraw.Draw(img)
+        for polygon in board.shape:
+          drw.polygon([ (x / self.resolution, y / self.resolution) for x, y in polygon ], fill = 1, outline = 1)
+        footprint = dilate(np.array(img, dtype = bool), int(ceil(board.clearance / self.resolution)))
+        if board.rotated:
+          footprint = np.rot90(footprint)
+      FOOTPRINTS[key] = footprint
+    return footprint
+
+  def reserve(self, board):
+    footprint = self._footprint(board)
+    h, w = footprint.shape
+    rows, cols = self.used.shape
+    col, row = int(floor(board.x / self.resolution)), int(floor(board.y / self.resolution))
+    # The board may not be aligned with the grid, cover both neighbouring cells
+    for dy in (0, 1):
+      for dx in (0, 1):
+        r, c = row + dy, col + dx
+        if (r >= 0) and (c >= 0) and (r < rows) and (c < cols):
+          self.used[r:r + h, c:c + w] |= footprint[:rows - r, :cols - c]
+    self._update()
+    Packer.reserve(self, board)
+
+  def place(self, board):
+    footprint = self._footprint(board)
+    h, w = footprint.shape
+    rows, cols = self.used.shape
+    if (w > cols) or (h > rows):
+      return False
+    # Overlap with the used area for every position of the board
+    overlap = np.fft.irfft2(np.fft.rfft2(self.used) * np.conj(np.fft.rfft2(footprint, self.used.shape)), self.used.shape)
+    free = overlap[:rows - h + 1, :cols - w + 1] < 0.5
+    columns = free.any(axis = 0)
+    if not columns.any():
+      return False
+    col = int(np.argmax(columns))
+    row = int(np.argmax(free[:, col]))
+    board.x, board.y = col * self.resolution, row * self.resolution
+    self.used[row:row + h, col:col + w] |= footprint
+    self._update()
+    self.placed.append(board)
+    return True
+
+# Available engines
+ENGINES = {
+  "grid": GridPacker,
+  "maxrects": MaxRectsPacker,
+  "bitmap": BitmapPacker,
+  "nest": NestPacker,
+  }
 
 #----------------------------------------------------------------------------
 # Manage panel layout
@@ -388,10 +702,14 @@ class Panel:
     """
     global CONFIG
     # Set up state
+    self.name = name
     self.w = CONFIG['panels'][name]['width']
     self.h = CONFIG['panels'][name]['height']
     self.padding = CONFIG['panels'][name].get('padding', 2)
     self.description = CONFIG['panels'][name].get('description', "(undefined)")
+    self.resolution = CONFIG['panels'][name].get('resolution', 0.5)
+    self.engine = "maxrects"
+    self.jobs = 1
     self.locked = list()
     if CONFIG['panels'][name].has_key("locked"):
       for lockInfo in CONFIG['panels'][name]['locked']:
@@ -426,43 +744,218 @@ class Panel:
     LOG.DEBUG("Positioning %s" % board)
     for x in range(0, int(self.w - board.w - 1)):
       for y in range(0, int(self.h - board.h - 1)):
-        LOG.DEBUG("  Testing %d, %d" % (x, y))
         board.x = x
         board.y = y
         # Does it overlap ?
         safe = True
         for existing in layout:
-          LOG.DEBUG("Checking against %s" % existing)
           if board.intersects(existing):
             safe = False
+            break
         if safe:
-          LOG.DEBUG("  Position is safe")
           return True
     return False
 
+  def _choices(self, boards, index, rotated):
+    """ Determine the rotations to try for the board at the given index
+    """
+    board = boards[index]
+    if board.w == board.h:
+      # Rotating a square board makes no difference
+      return (False, )
+    if (index > 0) and (boards[index - 1].name == board.name) and rotated:
+      # Copies of the same board are interchangeable so only the number of
+      # rotated copies matters - rotate them last
+      return (True, )
+    return (False, True)
+
+  def _search(self, packer, boards, index, rotated):
+    """ Branch and bound search over the board rotations
+
+      Boards are placed in order, trying each rotation in turn. Any partial
+      layout that already consumes more area than the best complete layout
+      is abandoned.
+    """
+    if index == len(boards):
+      area = self.consumed(packer.placed)
+      if (self._best is None) or (area < self._bestArea):
+        self._best = packer.placed
+        self._bestArea = area
+      return
+    for rotate in self._choices(boards, index, rotated):
+      candidate = boards[index].clone()
+      candidate.rotated = rotate
+      current = packer.clone()
+      if not current.place(candidate):
+        continue
+      if (self._best is not None) and (self.consumed(current.placed) >= self._bestArea):
+        continue
+      self._search(current, boards, index + 1, rotate)
+
+  def searchFrom(self, boards, prefix):
+    """ Search for the best layout with the rotations of the first boards
+        already decided.
+
+      Returns the best layout found (or None).
+    """
+    self._best, self._bestArea = None, None
+    packer = ENGINES[self.engine](self)
+    for index in range(len(prefix)):
+      candidate = boards[index].clone()
+      candidate.rotated = prefix[index]
+      if not packer.place(candidate):
+        return None
+    rotated = False
+    if len(prefix) > 0:
+      rotated = prefix[-1]
+    self._search(packer, boards, len(prefix), rotated)
+    return self._best
+
+  def _prefixes(self, boards, count):
+    """ Split the search into at least count independent parts
+
+      Returns a list of rotation choices for the first few boards.
+    """
+    prefixes = [ () ]
+    index = 0
+    while (len(prefixes) < count) and (index < len(boards)):
+      expanded = list()
+      for prefix in prefixes:
+        rotated = False
+        if len(prefix) > 0:
+          rotated = prefix[-1]
+        for rotate in self._choices(boards, index, rotated):
+          expanded.append(prefix + (rotate, ))
+      prefixes = expanded
+      index = index + 1
+    return prefixes
+
   def layout(self, *boards):
     """ Layout the set of boards on the panel
     """
-    best = None
-    for candidate in rotations(boards):
-      # This is an ugly brute force approach
-      current = list(self.locked)
-      placed = True
-      for board in candidate:
-        if self.findPosition(current, board):
-          LOG.DEBUG("Placed %s" % board)
-          current.append(board)
+    # Place the largest boards first, keeping copies of a board together
+    boards = sorted(boards, key = lambda b: (max(b.w, b.h), b.w * b.h, b.name), reverse = True)
+    if self.jobs > 1:
+      # Split the search over a pool of processes
+      tasks = [ (self, boards, prefix) for prefix in self._prefixes(boards, 4 * self.jobs) ]
+      pool = Pool(self.jobs)
+      try:
+        results = pool.map(searchTask, tasks)
+      finally:
+        pool.close()
+        pool.join()
+      best = None
+      for result in results:
+        if (result is not None) and ((best is None) or (self.consumed(result) < self.consumed(best))):
+          best = result
+      self.layout = best
+    else:
+      self.layout = self.searchFrom(boards, ())
+    return self.layout is not None
+
+  def extend(self, fixed, boards):
+    """ Add boards to an existing layout
+
+      The boards in 'fixed' keep their current positions, only the new boards
+      are searched for.
+    """
+    boards = sorted(boards, key = lambda b: (max(b.w, b.h), b.w * b.h, b.name), reverse = True)
+    packer = ENGINES[self.engine](self)
+    for board in fixed:
+      packer.reserve(board)
+    self._best, self._bestArea = None, None
+    self._search(packer, boards, 0, False)
+    self.layout = self._best
+    return self.layout is not None
+
+  def _arrange(self, boards, order, rotations):
+    """ Place boards in the given order and rotation
+
+      Returns a tuple of (score, layout). Layouts where some boards could not
+      be placed are given a score larger than any valid layout and a layout
+      of None.
+    """
+    packer = ENGINES[self.engine](self)
+    missing = 0
+    for index in order:
+      candidate = boards[index].clone()
+      candidate.rotated = rotations[index]
+      if not packer.place(candidate):
+        missing = missing + 1
+    if missing > 0:
+      return (missing + 1) * self.w * self.h, None
+    return self.consumed(packer.placed), packer.placed
+
+  def anneal(self, boards, budget):
+    """ Search for a layout using simulated annealing
+
+      The placement order and board rotations are randomly changed, keeping
+      any change that improves the layout (and occasionally one that does
+      not). The search stops after 'budget' seconds and keeps the best valid
+      layout found.
+    """
+    order = sorted(range(len(boards)), key = lambda i: (max(boards[i].w, boards[i].h), boards[i].w * boards[i].h), reverse = True)
+    rotations = [ False ] * len(boards)
+    rotatable = [ i for i in range(len(boards)) if boards[i].w <> boards[i].h ]
+    score, best = self._arrange(boards, order, rotations)
+    bestScore = score
+    hot, cold = 0.05 * self.w * self.h, 0.0001 * self.w * self.h
+    start = time()
+    elapsed = 0.0
+    while elapsed < budget:
+      # Make a random change
+      newOrder, newRotations = list(order), list(rotations)
+      if (len(rotatable) > 0) and ((len(boards) < 2) or (random() < 0.3)):
+        index = choice(rotatable)
+        newRotations[index] = not newRotations[index]
+      elif len(boards) > 1:
+        a, b = randint(0, len(boards) - 1), randint(0, len(boards) - 1)
+        if random() < 0.5:
+          newOrder[a], newOrder[b] = newOrder[b], newOrder[a]
         else:
-          placed = False
-          break
-      # Did we place all the boards ?
-      if placed:
-        # Update the 'best' solution
-        if (best is None) or (self.consumed(current) < self.consumed(best)):
-          best = current
+          newOrder.insert(b, newOrder.pop(a))
+      else:
+        break
+      newScore, layout = self._arrange(boards, newOrder, newRotations)
+      # Accept improvements and (sometimes) worse layouts
+      temperature = hot * ((cold / hot) ** (elapsed / budget))
+      if (newScore <= score) or (random() < exp((score - newScore) / temperature)):
+        order, rotations, score = newOrder, newRotations, newScore
+      if (layout is not None) and ((best is None) or (newScore < bestScore)):
+        best, bestScore = layout, newScore
+      elapsed = time() - start
     self.layout = best
     return self.layout is not None
 
+  def distribute(self, boards):
+    """ Split a set of boards over as few panels (of this type) as possible
+
+      Boards are placed largest first, each going on to the current panel if
+      it will fit (in either orientation) or held back for the next panel
+      if it won't. Returns a list of layouts, one for each panel, or None if
+      a board won't fit on an empty panel.
+    """
+    remaining = sorted(boards, key = lambda b: (b.w * b.h, max(b.w, b.h), b.name), reverse = True)
+    layouts = list()
+    while len(remaining) > 0:
+      packer = ENGINES[self.engine](self)
+      deferred = list()
+      for board in remaining:
+        placed = False
+        for rotate in self._choices([ board ], 0, False):
+          candidate = board.clone()
+          candidate.rotated = rotate
+          if packer.place(candidate):
+            placed = True
+            break
+        if not placed:
+          deferred.append(board)
+      if len(deferred) == len(remaining):
+        return None
+      layouts.append(packer.placed)
+      remaining = deferred
+    return layouts
+
   #--------------------------------------------------------------------------
   # Utility methods
   #--------------------------------------------------------------------------
@@ -483,6 +976,12 @@ class Panel:
     img = img.transpose(Image.FLIP_TOP_BOTTOM)
     img.save(filename)
 
+  def toJSON(self):
+    return {
+      "panel": self.name,
+      "boards": [ b for b in self.layout if b.name <> "_lock_" ],
+      }
+
   def __str__(self):
     return "%s - %0.1f x %0.1f mm" % (self.description, self.w, self.h)
 
@@ -490,6 +989,514 @@ class Panel:
 # Helpers
 #----------------------------------------------------------------------------
 
+def searchTask(task):
+  """ Search part of the layout space (run in a worker process)
+  """
+  panel, boards, prefix = task
+  return panel.searchFrom(boards, prefix)
+
+def layoutTask(task):
+  """ Find the best layout for a single panel (run in a worker process)
+  """
+  panel, boards, budget = task
+  if budget is not None:
+    panel.anneal(boards, budget)
+  else:
+    panel.layout(*boards)
+  return panel.layout
+
+def planPanels(panel, boards, multi, budget):
+  """ Lay out the boards on the given panel type
+
+    If multi is True the boards are spread over as many panels as needed. The
+    budget (if not None) is the total time to spend searching for layouts, it
+    is shared between the panels. Returns a list of panels (with layouts) or
+    None if the boards don't fit.
+  """
+  for board in boards:
+    if not panel.willFit(board):
+      return None
+  if not multi:
+    if area(*boards) > panel.area():
+      return None
+    layoutTask((panel, boards, budget))
+    if panel.layout is None:
+      return None
+    return [ panel ]
+  layouts = panel.distribute(boards)
+  if layouts is None:
+    return None
+  # Improve the layout of each panel (in parallel if possible)
+  workers = max(1, min(panel.jobs, len(layouts)))
+  if budget is not None:
+    # Panels are searched in batches of one per worker
+    budget = budget / int(ceil(float(len(layouts)) / workers))
+  panels, tasks = list(), list()
+  for layout in layouts:
+    current = Panel(panel.name)
+    current.engine = panel.engine
+    panels.append(current)
+    tasks.append((current, [ b for b in layout if b.name <> "_lock_" ], budget))
+  if workers > 1:
+    pool = Pool(workers)
+    try:
+      results = pool.map(layoutTask, tasks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = map(layoutTask, tasks)
+  for current, layout, result in zip(panels, layouts, results):
+    # Fall back to the initial layout if the search didn't find one
+    current.layout = result or layout
+  return panels
+
+def planTask(task):
+  """ Plan the layout for a panel type (run in a worker process)
+  """
+  return planPanels(*task)
+
+def pcbTask(task):
+  """ Load a single PCB (run in a worker process)
+
+    The configuration and options are passed in rather than relying on the
+    globals being set up in the worker. Returns a tuple of (name, pcb, error)
+    where one of pcb or error will be None.
+  """
+  global CONFIG, CONTROL, options
+  name, CONFIG, CONTROL, options = task
+  try:
+    return name, PCB(name), None
+  except Exception, ex:
+    return name, None, str(ex)
+
+def loadPCBs(names):
+  """ Load the named PCBs (in parallel if there is more than one)
+
+    Returns a dictionary mapping the board name to the PCB instance. Any
+    failure is fatal.
+  """
+  global CONFIG, CONTROL, options
+  tasks = [ (name, CONFIG, CONTROL, options) for name in names ]
+  if len(tasks) > 1:
+    pool = Pool(min(len(tasks), cpu_count()))
+    try:
+      results = pool.map(pcbTask, tasks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = map(pcbTask, tasks)
+  pcbs = dict()
+  for name, pcb, error in results:
+    if pcb is None:
+      LOG.FATAL("Could not load board '%s' - %s" % (name, error))
+    pcbs[name] = pcb
+  return pcbs
+
+def layoutKey(panel, boards, engine, multi, budget):
+  """ Generate the key used to cache a layout
+
+    The key is made up from the panel definition(s), the board names, sizes
+    and outlines and the options that affect the layout.
+  """
+  global CONFIG
+  definition = CONFIG['panels']
+  if panel <> "auto":
+    definition = definition[panel]
+  sizes = list()
+  for b in boards:
+    shape = None
+    if b.shape is not None:
+      shape = [ [ (round(x, 4), round(y, 4)) for x, y in polygon ] for polygon in b.shape ]
+    sizes.append((b.name, round(b.w, 4), round(b.h, 4), shape, round(b.clearance, 4)))
+  sizes.sort()
+  return md5(toJSON([ panel, definition, sizes, engine, multi, budget ], sort_keys = True)).hexdigest()
+
+def readLayout(data, pcbs, strict = True):
+  """ Restore a list of panels from saved layout data
+
+    Returns None if the layout refers to boards that are not loaded or whose
+    size has changed. If strict is False these boards are left out instead.
+  """
+  panels = list()
+  for entry in data.get("panels", ()):
+    panel = Panel(entry['panel'])
+    layout = list(panel.locked)
+    for info in entry['boards']:
+      board = None
+      if pcbs.has_key(info['name']):
+        board = pcbs[info['name']].getBoard()
+        if (abs(board.w - info['width']) > 0.001) or (abs(board.h - info['height']) > 0.001):
+          board = None
+      if board is None:
+        if strict:
+          return None
+        continue
+      board.x = info['x']
+      board.y = info['y']
+      board.rotated = info['rotated']
+      layout.append(board)
+    panel.layout = layout
+    panels.append(panel)
+  if len(panels) == 0:
+    return None
+  return panels
+
+def repack(panels, boards):
+  """ Update saved panel layouts to hold a new set of boards
+
+    Boards already on the panels stay where they are (unless they are no
+    longer needed) and any new boards are placed in the remaining space.
+    Returns the updated panels or None if the new boards won't fit.
+  """
+  # Work out which of the placed boards we can keep
+  wanted = dict()
+  for board in boards:
+    wanted[board.name] = wanted.get(board.name, 0) + 1
+  fixed = list()
+  for panel in panels:
+    kept = list()
+    for board in panel.layout:
+      if (board.name <> "_lock_") and (wanted.get(board.name, 0) > 0):
+        wanted[board.name] = wanted[board.name] - 1
+        kept.append(board)
+    fixed.append(kept)
+  remaining = list()
+  for board in boards:
+    if wanted.get(board.name, 0) > 0:
+      wanted[board.name] = wanted[board.name] - 1
+      remaining.append(board)
+  LOG.INFO("Keeping %d placed board(s), adding %d" % (sum([ len(f) for f in fixed ]), len(remaining)))
+  # Place the new boards
+  for panel, kept in zip(panels, fixed):
+    if (len(remaining) > 0) and panel.extend(kept, remaining):
+      remaining = list()
+      continue
+    # Place as many as we can on this panel
+    packer = ENGINES[panel.engine](panel)
+    for board in kept:
+      packer.reserve(board)
+    deferred = list()
+    for board in sorted(remaining, key = lambda b: (b.w * b.h, max(b.w, b.h), b.name), reverse = True):
+      placed = False
+      for rotate in panel._choices([ board ], 0, False):
+        candidate = board.clone()
+        candidate.rotated = rotate
+        if packer.place(candidate):
+          placed = True
+          break
+      if not placed:
+        deferred.append(board)
+    panel.layout = packer.placed
+    remaining = deferred
+  if len(remaining) > 0:
+    return None
+  return panels
+
+def layoutBoards(panels):
+  """ Get the (sorted) names of all boards placed on a list of panels
+  """
+  names = list()
+  for panel in panels:
+    names.extend([ b.name for b in panel.layout if b.name <> "_lock_" ])
+  return sorted(names)
+
+def generatePanel(panel, pcbs, output, settings, writer):
+  """ Generate all the output files for a panel
+  """
+  global options
+  # Show the current layout
+  panel.createImage("%s.png" % output)
+  LOG.INFO("Selected layout ...")
+  for board in panel.layout:
+    if board.name <> "_lock_":
+      LOG.INFO("  %s" % board)
+  # Now we generate the output files
+  if options.repeat is not None:
+    filenames = generateRepeated(panel, pcbs, output, settings, writer, options.repeat)
+    writeProject(panel, output, filenames)
+    return
+  top = GCode()
+  bottom = GCode()
+  outline = GCode()
+  drills = dict()
+  for board in panel.layout:
+    if board.name <> "_lock_":
+      pcbs[board.name].generateTopCopper(top, board, panel.h)
+      pcbs[board.name].generateBottomCopper(bottom, board)
+      pcbs[board.name].generateOutline(outline, board)
+      pcbs[board.name].generateDrills(drills, board)
+  # Only cut shared edges once
+  if options.common_line:
+    LOG.INFO("Merging common outline cuts")
+    outline = commonLine(outline.clone(ZLevel(cut = settings['pcbcut'])))
+  # Set up the processing for each layer
+  cutting, drilling = None, None
+  if options.feedrate is not None:
+    cutting = FeedRate(cutting = options.feedrate)
+  if options.drilling is not None:
+    drilling = FeedRate(drilling = options.drilling)
+  layers = [
+    ("_01_top.ngc", top, cutting, None, False, False),
+    ("_02_bottom.ngc", bottom, cutting, None, False, False),
+    ("_99_outline.ngc", outline, None, settings['pcbcut'], False, False),
+    ]
+  if options.drill_plan:
+    # All drills in a single file (already in the best order)
+    if len(drills) > 0:
+      layers.append(("_03_drill.ngc", planDrills(drills, settings), drilling, settings['pcbcut'], True, True))
+  else:
+    for index, diam in enumerate(sorted(drills.keys())):
+      layers.append(("_%02d_drill_%0.1f.ngc" % (index + 3, float(diam)), drills[diam], drilling, settings['pcbcut'], True, False))
+  tasks = list()
+  for suffix, gcode, flt, cut, drill, ordered in layers:
+    if gcode.minx is not None:
+      tasks.append((output + suffix, gcode, flt, cut, drill, ordered, settings, writer, options))
+  filenames = [ task[0] for task in tasks ]
+  # The layers are independent so process them in parallel
+  pool = None
+  if len(tasks) > 1:
+    pool = Pool(min(len(tasks), cpu_count()))
+  try:
+    if pool is not None:
+      results = pool.imap_unordered(layerTask, tasks)
+    else:
+      results = map(layerTask, tasks)
+    for index, (filename, summary, log) in enumerate(results):
+      log.replay(LOG)
+      LOG.INFO("Generated %s (%d of %d)" % (filename, index + 1, len(tasks)))
+      LOG.INFO("  %s" % summary)
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+  # Finally generate a OpenSCAM project with all the files
+  writeProject(panel, output, filenames)
+
+def writeProject(panel, output, filenames):
+  """ Generate an OpenSCAM project with all the files for a panel
+  """
+  with open("%s.xml" % output, "w") as target:
+    target.write(Template(OPENSCAM_XML).safe_substitute({
+      "panel_width": str(panel.w),
+      "panel_height": str(panel.h),
+      "filenames": " ".join([ basename(f) for f in filenames ])
+      }))
+
+def finishLayer(gcode, settings, flt = None, cut = None, reorder = True, log = LOG):
+  """ Apply the final adjustments to a layer before it is saved
+
+    If reorder is False the optimiser is not used (the order of the commands
+    has already been decided). Progress is reported through the given logger.
+  """
+  global options
+  if options.dedupe:
+    gcode = gcode.clone(RemoveDuplicate())
+  if options.optimise and reorder:
+    gcode = optimise(gcode, log)
+  if flt is not None:
+    gcode = gcode.clone(flt)
+  if cut is not None:
+    gcode = gcode.clone(ZLevel(cut = cut))
+  # Correct arcs and adjust safe height
+  gcode = gcode.clone(CorrectArc(), ZLevel(safe = settings['safe']))
+  # Strip out redundant commands if requested
+  if options.clean:
+    gcode = gcode.clone(RemoveRedundant())
+  return gcode
+
+def orderHoles(holes, x, y):
+  """ Order a set of holes by always moving to the closest remaining one
+
+    Returns a tuple of (holes, distance) with the holes in the new order and
+    the total distance travelled from (x, y).
+  """
+  done = np.zeros(len(holes), dtype = bool)
+  order = list()
+  travel = 0.0
+  for i in range(len(holes)):
+    distances = np.hypot(holes[:, 0] - x, holes[:, 1] - y)
+    distances[done] = np.inf
+    index = int(np.argmin(distances))
+    travel = travel + distances[index]
+    done[index] = True
+    order.append(index)
+    x, y = holes[index]
+  return holes[order], travel
+
+def orderDrills(groups, toolchange):
+  """ Decide the order to drill a set of hole groups in
+
+    Each group starts with the hole closest to where the previous one
+    finished. Returns a tuple of (plan, cost) where plan is a list of
+    (diameter, holes) tuples and the cost is the travel distance plus the
+    given cost for each tool change.
+  """
+  remaining = dict(groups)
+  x, y = 0.0, 0.0
+  plan = list()
+  travel = 0.0
+  while len(remaining) > 0:
+    diam = min(remaining.keys(), key = lambda d: (np.hypot(remaining[d][:, 0] - x, remaining[d][:, 1] - y).min(), d))
+    holes, distance = orderHoles(remaining.pop(diam), x, y)
+    plan.append((diam, holes))
+    travel = travel + distance
+    x, y = holes[-1]
+  return plan, travel + (toolchange * len(plan))
+
+def planDrills(drills, settings):
+  """ Combine the drill files for a panel into a single drilling plan
+
+    The drills have already been merged (if requested) so the plan uses the
+    sizes as given. Returns the gcode for the plan.
+  """
+  global CONFIG, options
+  toolchange = CONFIG.get("toolchange", 300.0)
+  groups = dict()
+  for diam in drills.keys():
+    points = [ (p.x, p.y) for p in getMovements(drills[diam])[0] if p.__class__ == Point ]
+    if len(points) > 0:
+      groups[diam] = np.array(points, dtype = float)
+  plan, cost = orderDrills(groups, toolchange)
+  LOG.INFO("Drilling plan uses %d tool(s), cost %0.1f" % (len(plan), cost))
+  # Generate the gcode
+  gcode = GCode()
+  gcode.append("G00 Z%0.4f" % settings['safe'])
+  for index, (diam, holes) in enumerate(plan):
+    change = GCommand()
+    if options.tool_change:
+      change.command = "M06"
+      change.T = index + 1
+      change.comment = "(%0.1fmm drill)" % diam
+    else:
+      change.command = "M00"
+      change.comment = "(Change to %0.1fmm drill)" % diam
+    gcode.append(change)
+    for x, y in holes:
+      gcode.append("G00 X%0.4f Y%0.4f" % (x, y))
+      gcode.append("G01 Z%0.4f F%0.4f" % (settings['pcbcut'], CONFIG['penetrate']))
+      gcode.append("G00 Z%0.4f" % settings['safe'])
+  return gcode
+
+def layerTask(task):
+  """ Optimise, filter, save and render a single layer (run in a worker process)
+
+    Returns a tuple of (filename, summary, log) where log holds the progress
+    messages to be written by the parent.
+  """
+  global options
+  filename, gcode, flt, cut, drill, ordered, settings, writer, options = task
+  log = BufferedLogger()
+  gcode = finishLayer(gcode, settings, flt, cut, reorder = not ordered, log = log)
+  output = gcode
+  if drill and options.canned:
+    output = gcode.clone(DrillCycle(options.peck))
+  saveGCode(filename, output, prefix = settings['prefix'], suffix = settings['suffix'], writer = writer)
+  gcode.render(splitext(filename)[0] + ".png")
+  return filename, str(gcode), log
+
+def saveRepeated(filename, bodies, calls, settings, writer, dialect):
+  """ Save a layer as a set of subprograms and the calls to them
+
+    Each body is the toolpath for a board relative to its bottom left corner.
+    The calls are a list of (index, position) tuples, the origin is moved to
+    the position with G92 before the body at the given index is called.
+  """
+  style = SUBPROGRAMS[dialect]
+  if writer is None:
+    writer = Writer()
+  subprograms = list()
+  for index, body in enumerate(bodies):
+    number = { "number": SUBPROGRAM_BASE + index }
+    subprograms.append(style["start"] % number)
+    # Each call starts from an unknown state
+    writer.reset()
+    subprograms.extend(writer.formatLines(body.lines))
+    subprograms.append(style["end"] % number)
+  lines = list()
+  if settings['prefix'] is not None:
+    lines.append(str(settings['prefix']).strip())
+  if style["before"]:
+    lines.extend(subprograms)
+  for index, board in calls:
+    lines.append("(INFO: %s @ %0.4f, %0.4f rot = %s)" % (board.name, board.x, board.y, board.rotated))
+    lines.append("G00 Z%0.4f" % settings['safe'])
+    lines.append("G00 X%0.4f Y%0.4f" % (board.x, board.y))
+    lines.append("G92 X0 Y0")
+    lines.append(style["call"] % { "number": SUBPROGRAM_BASE + index })
+    lines.append("G92.1")
+  # Subprograms that follow the main program must still come before the
+  # end of tape marker
+  trailer = list()
+  if settings['suffix'] is not None:
+    suffix = str(settings['suffix']).strip().split("\n")
+    if (not style["before"]) and (suffix[-1].strip() == "%"):
+      trailer.append(suffix.pop().strip())
+    lines.extend(suffix)
+  if not style["before"]:
+    lines.extend(subprograms)
+  lines.extend(trailer)
+  lines.append("")
+  with open(filename, "w") as target:
+    target.write("\n".join(lines))
+
+def generateRepeated(panel, pcbs, output, settings, writer, dialect):
+  """ Generate the output files for a panel using subprograms
+
+    Each distinct board layer (in each orientation) is written once as a
+    subprogram which is then called for every placement. Returns the list of
+    files generated.
+  """
+  global options
+  boards = [ b for b in panel.layout if b.name <> "_lock_" ]
+  # Work out what layers we need
+  cutting, drilling = None, None
+  if options.feedrate is not None:
+    cutting = FeedRate(cutting = options.feedrate)
+  if options.drilling is not None:
+    drilling = FeedRate(drilling = options.drilling)
+  layers = [
+    ("_02_bottom.ngc", "bottom", cutting, None, False),
+    ("_99_outline.ngc", "outline", None, settings['pcbcut'], False),
+    ]
+  diameters = set()
+  for board in boards:
+    diameters.update(pcbs[board.name].drills.keys())
+  for index, diam in enumerate(sorted(diameters)):
+    layers.append(("_%02d_drill_%0.1f.ngc" % (index + 3, float(diam)), ("drill", diam), drilling, settings['pcbcut'], True))
+  # Generate each layer
+  filenames = list()
+  for suffix, key, flt, cut, drill in layers:
+    bodies, calls, indices = list(), list(), dict()
+    for board in boards:
+      pcb = pcbs[board.name]
+      layer = pcb.getLayer(key, board.rotated)
+      if (layer is None) or (layer.minx is None):
+        continue
+      if not indices.has_key((board.name, board.rotated)):
+        body = GCode()
+        body.appendOffset(layer, pcb.padding, pcb.padding)
+        indices[(board.name, board.rotated)] = len(bodies)
+        bodies.append(finishLayer(body, settings, flt, cut))
+      calls.append((indices[(board.name, board.rotated)], board))
+    if len(calls) == 0:
+      continue
+    filename = output + suffix
+    filenames.append(filename)
+    LOG.INFO("Generating %s (%d subprograms, %d placements)" % (filename, len(bodies), len(calls)))
+    if drill and options.canned:
+      saveRepeated(filename, [ b.clone(DrillCycle(options.peck)) for b in bodies ], calls, settings, writer, dialect)
+    else:
+      saveRepeated(filename, bodies, calls, settings, writer, dialect)
+    # Render the complete layer
+    gcode = GCode()
+    for index, board in calls:
+      gcode.appendOffset(bodies[index], board.x, board.y)
+    LOG.INFO("  %s" % str(gcode))
+    gcode.render(splitext(filename)[0] + ".png")
+  return filenames
+
 BOARD_CACHE = dict()
 
 def loadBoard(name):
@@ -535,126 +1542,165 @@ if __name__ == "__main__":
   parser.add_option("-m", "--merge", action="store_true", default=False, dest="merge")
   parser.add_option("-f", "--feed", action="store", type="float", dest="feedrate")
   parser.add_option("-r", "--drill", action="store", type="float", dest="drilling")
+  parser.add_option("--clean", action="store_true", default=False, dest="clean")
+  parser.add_option("--compact", action="store_true", default=False, dest="compact")
+  parser.add_option("--save-layout", action="store", type="string", dest="save_layout")
+  parser.add_option("--load-layout", action="store", type="string", dest="load_layout")
+  parser.add_option("-i", "--incremental", action="store_true", default=False, dest="incremental")
+  parser.add_option("--no-cache", action="store_false", default=True, dest="cache")
+  parser.add_option("--repeat", action="store", type="choice", choices=sorted(SUBPROGRAMS.keys()), dest="repeat")
+  parser.add_option("--drill-plan", action="store_true", default=False, dest="drill_plan")
+  parser.add_option("--tool-change", action="store_true", default=False, dest="tool_change")
+  parser.add_option("--canned", action="store_true", default=False, dest="canned")
+  parser.add_option("--peck", action="store", type="float", dest="peck")
+  parser.add_option("--dedupe", action="store_true", default=False, dest="dedupe")
+  parser.add_option("--common-line", action="store_true", default=False, dest="common_line")
+  parser.add_option("-M", "--multi", action="store_true", default=False, dest="multi")
+  parser.add_option("-t", "--time", action="store", type="float", dest="time")
+  parser.add_option("-j", "--jobs", action="store", type="int", default=1, dest="jobs")
+  parser.add_option("-e", "--engine", action="store", type="choice", choices=sorted(ENGINES.keys()), default="maxrects", dest="engine")
   options, args = parser.parse_args()
   # Check for required options
   for required in ("output", "panel"):
     if getattr(options, required) is None:
       LOG.FATAL("Missing required option '%s'" % required)
+  if options.peck is not None:
+    options.canned = True
+  if options.drill_plan and (options.repeat is not None):
+    LOG.FATAL("The --drill-plan and --repeat options can't be used together")
+  if options.common_line and (options.repeat is not None):
+    LOG.FATAL("The --common-line and --repeat options can't be used together")
   if options.debug:
     LOG.severity = Logger.MSG_DEBUG
   else:
     LOG.severity = Logger.MSG_INFO
-  # Set up the panel
-  try:
-    panel = Panel(options.panel)
-  except Exception, ex:
-    LOG.FATAL("Could not load panel definition '%s'" % options.panel)
-  LOG.DEBUG("Panel - %s" % panel)
-  # Load boards
-  pcbs = dict()
-  boards = list()
+  # Set up the panel(s)
+  names = [ options.panel ]
+  if options.panel == "auto":
+    names = sorted(CONFIG['panels'].keys())
+  candidates = list()
+  for name in names:
+    try:
+      panel = Panel(name)
+    except Exception, ex:
+      LOG.FATAL("Could not load panel definition '%s'" % name)
+    panel.engine = options.engine
+    panel.jobs = max(1, options.jobs)
+    LOG.DEBUG("Panel - %s" % panel)
+    candidates.append(panel)
+  # Work out which arguments are boards and which are counts
+  entries = list()
   count = 1
   for name in args:
-    havePCB = True
-    if not pcbs.has_key(name):
+    if not exists(join(realpath(CONFIG['boards']), name)):
       try:
-        pcbs[name] = PCB(name)
-      except Exception, ex:
-        # See if it is an integer count
-        try:
-          count = int(name)
-          havePCB = False
-        except:
-          LOG.FATAL(str(ex))
-    if havePCB:
-      board = pcbs[name].getBoard()
-      if not panel.willFit(board):
-        LOG.FATAL("Board %s will not fit on this panel" % name)
-      for i in range(count):
-        boards.append(board)
-      count = 1
+        count = int(name)
+        continue
+      except:
+        pass
+    entries.append((name, count))
+    count = 1
+  # Load boards
+  pcbs = loadPCBs(sorted(set([ name for name, count in entries ])))
+  boards = list()
+  for name, count in entries:
+    board = pcbs[name].getBoard()
+    for i in range(count):
+      boards.append(board)
   if len(boards) == 0:
     LOG.FATAL("No boards specified on command line")
-  # Make sure they can reasonably fit
-  if area(*boards) > panel.area():
-    LOG.FATAL("This board combination cannot fit on the selected panel - board area = %0.2f, panel area = %0.2f" % (area(*boards), panel.area()))
+  # Look for an existing layout
+  panels = None
+  key = layoutKey(options.panel, boards, options.engine, options.multi, options.time)
+  cache = dict()
+  cachefile = CONFIG.get("cache", None)
+  if options.load_layout is not None:
+    try:
+      data = fromJSONFile(options.load_layout)
+    except Exception, ex:
+      LOG.FATAL("Could not load layout file '%s' - %s" % (options.load_layout, ex))
+    if options.incremental:
+      # Add (or remove) boards without disturbing the rest of the layout
+      panels = readLayout(data, pcbs, strict = False)
+      if panels is not None:
+        for panel in panels:
+          panel.engine = options.engine
+        panels = repack(panels, boards)
+      if panels is None:
+        LOG.INFO("Unable to update the layout in '%s', starting again" % options.load_layout)
+      else:
+        LOG.INFO("Updated layout from '%s'" % options.load_layout)
+    else:
+      panels = readLayout(data, pcbs)
+      if (panels is None) or (layoutBoards(panels) <> sorted([ b.name for b in boards ])):
+        LOG.FATAL("The layout in '%s' does not match the boards given" % options.load_layout)
+      LOG.INFO("Using layout from '%s'" % options.load_layout)
+  elif (cachefile is not None) and options.cache:
+    if exists(cachefile):
+      try:
+        cache = fromJSONFile(cachefile)
+      except Exception, ex:
+        LOG.WARN("Could not read layout cache '%s' - %s" % (cachefile, ex))
+    if cache.has_key(key):
+      panels = readLayout(cache[key], pcbs)
+      if panels is not None:
+        LOG.INFO("Using cached layout")
   # Do the layout
-  if not panel.layout(*boards):
-    LOG.FATAL("Unable to find a combination that will fit")
-  # Show the current layout
-  panel.createImage("%s.png" % options.output)
-  LOG.INFO("Selected layout ...")
-  for board in panel.layout:
-    if board.name <> "_lock_":
-      LOG.INFO("  %s" % board)
-  # Now we generate the output files
-  top = GCode()
-  bottom = GCode()
-  outline = GCode()
-  drills = dict()
-  for board in panel.layout:
-    if board.name <> "_lock_":
-      pcbs[board.name].generateTopCopper(top, board, panel.h)
-      pcbs[board.name].generateBottomCopper(bottom, board)
-      pcbs[board.name].generateOutline(outline, board)
-      pcbs[board.name].generateDrills(drills, board)
-  # Generate optimised copies if requested
-  if options.optimise:
-    LOG.INFO("Optimising ...")
-    LOG.INFO("  Top copper")
-    top = optimise(top)
-    LOG.INFO("  Bottom copper")
-    bottom = optimise(bottom)
-    LOG.INFO("  Board outline")
-    outline = optimise(outline)
-    for diam in drills.keys():
-      LOG.INFO("  Drill (%0.1fmm)" % diam)
-      drills[diam] = optimise(drills[diam])
-  # Adjust the feed rate if required
-  feedrate = getattr(options, "feedrate")
-  if feedrate is not None:
-    flt = FeedRate(cutting = feedrate)
-    top = top.clone(flt)
-    bottom = bottom.clone(flt)
-  # Save all the main files
-  filenames = list()
+  if panels is None:
+    if len(candidates) > 1:
+      # Try every panel type at the same time and pick the least wasteful
+      LOG.INFO("Comparing %d panel types ..." % len(candidates))
+      for panel in candidates:
+        panel.jobs = 1
+      pool = Pool(len(candidates))
+      try:
+        results = pool.map(planTask, [ (panel, boards, options.multi, options.time) for panel in candidates ])
+      finally:
+        pool.close()
+        pool.join()
+      panels, best = None, None
+      for panel, result in zip(candidates, results):
+        if result is None:
+          LOG.INFO("  %s (%s) - boards will not fit" % (panel.name, panel))
+          continue
+        waste = (len(result) * panel.area()) - area(*boards)
+        LOG.INFO("  %s (%s) - %d panel(s), %0.2f mm^2 unused" % (panel.name, panel, len(result), waste))
+        if (best is None) or ((len(result), waste) < best):
+          panels, best = result, (len(result), waste)
+      if panels is None:
+        LOG.FATAL("Unable to find a combination that will fit")
+      LOG.INFO("Selected %s" % panels[0].name)
+    else:
+      panel = candidates[0]
+      for board in boards:
+        if not panel.willFit(board):
+          LOG.FATAL("Board %s will not fit on this panel" % board.name)
+      # Make sure they can reasonably fit
+      if (not options.multi) and (area(*boards) > panel.area()):
+        LOG.FATAL("This board combination cannot fit on the selected panel - board area = %0.2f, panel area = %0.2f" % (area(*boards), panel.area()))
+      if options.time is not None:
+        LOG.INFO("Searching for a layout (%0.1f seconds) ..." % options.time)
+      panels = planPanels(panel, boards, options.multi, options.time)
+      if panels is None:
+        LOG.FATAL("Unable to find a combination that will fit")
+      if options.multi:
+        LOG.INFO("Using %d panel(s) (at least %d needed by area)" % (len(panels), int(ceil(area(*boards) / panel.area()))))
+    # Save it for next time
+    if (cachefile is not None) and options.cache:
+      cache[key] = { "panels": panels }
+      with open(cachefile, "w") as target:
+        target.write(toJSON(cache))
+  if options.save_layout is not None:
+    with open(options.save_layout, "w") as target:
+      target.write(toJSON({ "panels": panels }, indent = 2))
+  # Generate the output for each panel
   settings = getSettings(CONTROL, options)
-  for filename, gcode in (("_01_top.ngc", top), ("_02_bottom.ngc", bottom), ("_99_outline.ngc", outline.clone(ZLevel(cut = settings['pcbcut'])))):
-    if gcode.minx is not None:
-      # Correct arcs and adjust safe height
-      gcode = gcode.clone(CorrectArc(), ZLevel(safe = settings['safe']))
-      # Write the file
-      filename = options.output + filename
-      filenames.append(filename)
-      LOG.INFO("Generating %s" % filename)
-      saveGCode(filename, gcode, prefix = settings['prefix'], suffix = settings['suffix'])
-      LOG.INFO("  %s" % str(gcode))
-      gcode.render(splitext(filename)[0] + ".png")
-  # Save the drill files
-  index = 3
-  # Adjust the feed rate if required
-  feedrate = getattr(options, "drilling")
-  flt = None
-  if feedrate is not None:
-    flt = FeedRate(drilling = feedrate)
-  for diam in sorted(drills.keys()):
-    # Correct arcs and adjust safe/cutting depths
-    drills[diam] = drills[diam].clone(CorrectArc(), ZLevel(safe = settings['safe'], cut = settings['pcbcut']))
-    if flt is not None:
-      drills[diam] = drills[diam].clone(flt)
-    # Write the file
-    filename = "%s_%02d_drill_%0.1f.ngc" % (options.output, index, float(diam))
-    filenames.append(filename)
-    LOG.INFO("Generating %s" % filename)
-    saveGCode(filename, drills[diam], prefix = settings['prefix'], suffix = settings['suffix'])
-    LOG.INFO("  %s" % str(drills[diam]))
-    drills[diam].render(splitext(filename)[0] + ".png")
-    index = index + 1
-  # Finally generate a OpenSCAM project with all the files
-  with open("%s.xml" % options.output, "w") as output:
-    output.write(Template(OPENSCAM_XML).safe_substitute({
-      "panel_width": str(panel.w),
-      "panel_height": str(panel.h),
-      "filenames": " ".join([ basename(f) for f in filenames ])
-      }))
-
+  writer = None
+  if options.compact:
+    writer = CompactWriter(axes = settings.get('precision'))
+  for index in range(len(panels)):
+    output = options.output
+    if len(panels) > 1:
+      output = "%s_panel%02d" % (options.output, index + 1)
+      LOG.INFO("Panel %d of %d" % (index + 1, len(panels)))
+    generatePanel(panels[index], pcbs, output, settings, writer)
@@ -4,13 +4,19 @@
 #
 # Utility classes and methods for gcode manipulation.
 #----------------------------------------------------------------------------
-from logger import LOG, Logger
+from logger import LOG, Logger, BufferedLogger
 from jsonhelp import toJSON, fromJSON, fromJSONFile
-from gcode import PARAMS, GCommand, GCode, Loader, Filter, FilterChain, loadGCode, saveGCode
-from filters import SwapXY, Translate, Rotate, Flip, ZLevel, FeedRate
+from gcode import PARAMS, GCommand, GCode, Loader, Filter, FilterChain, Writer, CompactWriter, loadGCode, saveGCode
+from filters import SwapXY, Translate, Rotate, Flip, ZLevel, FeedRate, RemoveRedundant, DrillCycle, LineRun
 from arcfix import CorrectArc
+from arcfit import FitArc
+from simplify import Simplify
+from linearise import LineariseArc
 from loaders import BoxedLoader
 from options import getSettings
 from filename import defaultExtension
-from optimise import optimise
+from optimise import Point, optimise, getMovements
+from commonline import commonLine
+from duplicate import RemoveDuplicate
+from excellon import loadExcellon, mergeDrills
 
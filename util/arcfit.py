@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------------
+# 18-Oct-2026 ShaneG
+#
+# Flattened curves (from svg2ngc or GCode.circle for example) are made up
+# of a large number of very short G01 moves. This filter finds runs of points
+# that lie on a circular arc (within a tolerance) and replaces them with a
+# single G02/G03 command.
+#----------------------------------------------------------------------------
+from gcode import GCommand
+from filters import LineRun
+from math import sqrt, atan2, pi
+
+#----------------------------------------------------------------------------
+# Calculations
+#----------------------------------------------------------------------------
+
+def circleFrom(x1, y1, x2, y2, x3, y3):
+  """ Calculate the circle passing through three points
+
+    Returns a tuple of (cx, cy, radius) or None if the points are collinear.
+  """
+  d = 2.0 * ((x1 * (y2 - y3)) + (x2 * (y3 - y1)) + (x3 * (y1 - y2)))
+  if d == 0.0:
+    return None
+  s1 = (x1 ** 2) + (y1 ** 2)
+  s2 = (x2 ** 2) + (y2 ** 2)
+  s3 = (x3 ** 2) + (y3 ** 2)
+  cx = ((s1 * (y2 - y3)) + (s2 * (y3 - y1)) + (s3 * (y1 - y2))) / d
+  cy = ((s1 * (x3 - x2)) + (s2 * (x1 - x3)) + (s3 * (x2 - x1))) / d
+  return cx, cy, sqrt(((x1 - cx) ** 2) + ((y1 - cy) ** 2))
+
+#----------------------------------------------------------------------------
+# Filter
+#----------------------------------------------------------------------------
+
+class FitArc(LineRun):
+  """ Replace runs of short G01 moves with G02/G03 arcs
+  """
+
+  # Minimum number of line segments to replace with a single arc
+  MIN_SEGMENTS = 3
+
+  def __init__(self, tolerance = 0.01, maxradius = 1000.0):
+    """ Constructor
+
+      The tolerance is the maximum distance (in mm) the arc may stray from the
+      original path. Arcs with a radius larger than maxradius are treated as
+      straight lines.
+    """
+    LineRun.__init__(self)
+    self.tolerance = tolerance
+    self.maxradius = maxradius
+
+  def _fits(self, points, start, end):
+    """ Try to fit an arc to the points between start and end (inclusive)
+
+      Returns a tuple of (command, cx, cy) or None if no arc fits.
+    """
+    x1, y1 = points[start]
+    x2, y2 = points[(start + end) / 2]
+    x3, y3 = points[end]
+    circle = circleFrom(x1, y1, x2, y2, x3, y3)
+    if circle is None:
+      return None
+    cx, cy, r = circle
+    if r > self.maxradius:
+      return None
+    # Every step must turn the same way and stay on the circle
+    swept = 0.0
+    direction = None
+    for index in range(start, end):
+      ax, ay = points[index][0] - cx, points[index][1] - cy
+      bx, by = points[index + 1][0] - cx, points[index + 1][1] - cy
+      if abs(sqrt((bx ** 2) + (by ** 2)) - r) > self.tolerance:
+        return None
+      angle = atan2((ax * by) - (ay * bx), (ax * bx) + (ay * by))
+      if (angle == 0.0) or ((direction is not None) and ((angle > 0.0) <> direction)):
+        return None
+      direction = angle > 0.0
+      swept = swept + abs(angle)
+      # The chord between the points must be close to the arc
+      chord = sqrt(((bx - ax) ** 2) + ((by - ay) ** 2)) / 2.0
+      if (r - sqrt(max(0.0, (r ** 2) - (chord ** 2)))) > self.tolerance:
+        return None
+    if swept >= (2 * pi):
+      return None
+    if direction:
+      return "G03", cx, cy
+    return "G02", cx, cy
+
+  def process(self, points, commands):
+    """ Replace as many segments as possible with arcs
+    """
+    results = list()
+    index = 0
+    while index < len(commands):
+      best = None
+      last, bad = len(points) - 1, len(points)
+      end = index + FitArc.MIN_SEGMENTS
+      step = 1
+      # Grow the run in increasing steps until the arc no longer fits
+      while end <= last:
+        arc = self._fits(points, index, end)
+        if arc is None:
+          bad = end
+          break
+        best = (end, arc)
+        if end == last:
+          break
+        end = min(end + step, last)
+        step = step * 2
+      # Then narrow down the longest run that does
+      while (best is not None) and ((bad - best[0]) > 1):
+        end = (best[0] + bad) / 2
+        arc = self._fits(points, index, end)
+        if arc is None:
+          bad = end
+        else:
+          best = (end, arc)
+      if best is None:
+        results.append(commands[index])
+        index = index + 1
+      else:
+        end, (command, cx, cy) = best
+        arc = GCommand()
+        arc.command = command
+        arc.X, arc.Y = points[end]
+        arc.I = cx - points[index][0]
+        arc.J = cy - points[index][1]
+        arc.F = commands[index].F
+        results.append(arc)
+        index = end
+    return results
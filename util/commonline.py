@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------------
+# 18-Oct-2026 ShaneG
+#
+# Common line cutting. When boards are placed edge to edge the outlines of
+# neighbouring boards share edges which would otherwise be cut twice. This
+# finds straight cuts that lie on the same line (within a tolerance) and
+# combines any that overlap so each physical cut is only made once.
+#----------------------------------------------------------------------------
+from gcode import GCode
+from optimise import Line, getMovements
+from math import atan2, cos, sin, pi, ceil, floor
+
+#--- Size of the buckets used to index lines by direction (radians)
+ANGLE_STEP = 0.001
+
+class LineIndex:
+  """ Identify the infinite line that straight segments lie on
+
+    Segments are indexed by direction and distance from the origin so only
+    a handful of candidate lines need to be checked. A segment is only
+    treated as being on an existing line if both of its end points are
+    within the tolerance of that line.
+  """
+
+  def __init__(self, tolerance):
+    """ Constructor
+    """
+    self.tolerance = tolerance
+    self.buckets = int(ceil(pi / ANGLE_STEP))
+    self.index = dict()
+    self.lines = list()
+
+  def _bucket(self, line):
+    """ Get the (angle, offset) bucket for a segment
+
+      Returns a tuple of (bucket, ux, uy) where (ux, uy) is the unit
+      direction of the segment (the same for both ways along it).
+    """
+    angle = atan2(line.ty - line.y, line.tx - line.x)
+    if angle < 0.0:
+      angle = angle + pi
+    if angle >= pi:
+      angle = angle - pi
+    ux, uy = cos(angle), sin(angle)
+    offset = (ux * line.y) - (uy * line.x)
+    bucket = min(int(angle / ANGLE_STEP), self.buckets - 1)
+    return (bucket, int(floor(offset / self.tolerance))), ux, uy
+
+  def _candidates(self, bucket):
+    """ Generate the keys of the given bucket and its neighbours
+
+      The direction flips when the angle wraps around so the offset of the
+      line changes sign as well.
+    """
+    angle, offset = bucket
+    for da in (-1, 0, 1):
+      a, sign = angle + da, 1
+      if a < 0:
+        a, sign = a + self.buckets, -1
+      elif a >= self.buckets:
+        a, sign = a - self.buckets, -1
+      for do in (-1, 0, 1):
+        yield a, (sign * offset) + do
+
+  def _onLine(self, index, x, y):
+    """ Determine if a point is within the tolerance of a known line
+    """
+    lx, ly, ux, uy = self.lines[index]
+    return abs(((x - lx) * uy) - ((y - ly) * ux)) <= self.tolerance
+
+  def find(self, line):
+    """ Find (or add) the line the segment lies on
+
+      Returns a tuple of (key, ux, uy) where the key identifies the line and
+      (ux, uy) is its unit direction.
+    """
+    bucket, ux, uy = self._bucket(line)
+    for key in self._candidates(bucket):
+      for index in self.index.get(key, ()):
+        if self._onLine(index, line.x, line.y) and self._onLine(index, line.tx, line.ty):
+          return index, self.lines[index][2], self.lines[index][3]
+    # Start a new line
+    index = len(self.lines)
+    self.lines.append((line.x, line.y, ux, uy))
+    self.index.setdefault(bucket, list()).append(index)
+    return index, ux, uy
+
+def mergeLines(lines, ux, uy, tolerance):
+  """ Combine a set of collinear lines
+
+    Returns a list of Line instances covering the same ground with no
+    overlaps. The end points are taken from the original lines.
+  """
+  spans = list()
+  for line in lines:
+    t1 = (ux * line.x) + (uy * line.y)
+    t2 = (ux * line.tx) + (uy * line.ty)
+    if t1 <= t2:
+      spans.append((t1, (line.x, line.y), t2, (line.tx, line.ty)))
+    else:
+      spans.append((t2, (line.tx, line.ty), t1, (line.x, line.y)))
+  spans.sort()
+  results = list()
+  start, first, end, last = spans[0]
+  for t1, p1, t2, p2 in spans[1:]:
+    if t1 <= (end + tolerance):
+      # Overlaps (or touches) the current span
+      if t2 > end:
+        end, last = t2, p2
+    else:
+      results.append(Line(first[0], first[1], last[0], last[1]))
+      start, first, end, last = t1, p1, t2, p2
+  results.append(Line(first[0], first[1], last[0], last[1]))
+  return results
+
+def commonLine(source, tolerance = 0.01):
+  """ Return a copy of the gcode with overlapping straight cuts merged
+
+    Each cut is generated as a separate operation so the result should be
+    passed through the optimiser to join them back into continuous paths.
+  """
+  cut, safe = source.minz, source.maxz
+  movements, insert_feed, feed, airtime = getMovements(source)
+  # Group the straight lines by the line they sit on
+  others = list()
+  groups = dict()
+  index = LineIndex(tolerance)
+  for movement in movements:
+    if (movement.__class__ <> Line) or ((movement.x == movement.tx) and (movement.y == movement.ty)):
+      others.append(movement)
+      continue
+    key, ux, uy = index.find(movement)
+    if not groups.has_key(key):
+      groups[key] = (ux, uy, list())
+    groups[key][2].append(movement)
+  # Merge each group
+  for key in sorted(groups.keys()):
+    ux, uy, lines = groups[key]
+    others.extend(mergeLines(lines, ux, uy, tolerance))
+  # Generate the new gcode
+  result = GCode()
+  for movement in others:
+    result.append("G00 Z%0.4f" % safe)
+    result.append("G00 X%0.4f Y%0.4f" % (movement.x, movement.y))
+    result.append("G01 Z%0.4f F%0.4f" % (cut, insert_feed))
+    movement.generate(result, feed)
+  result.append("G00 Z%0.4f" % safe)
+  return result
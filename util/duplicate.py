@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------------
+# 18-Oct-2026 ShaneG
+#
+# Remove cuts that have already been made. Merging files (or overlapping
+# boards) often results in the same segment being cut more than once, the
+# rings around pads for example or overlapping isolation passes. This filter
+# keeps a record of every cut (with the end points quantised so they can be
+# hashed) and drops any that repeat earlier work. Straight cuts that partially
+# overlap an earlier cut on the same line are trimmed to the new section.
+#----------------------------------------------------------------------------
+from bisect import bisect_left
+from gcode import Filter, GCommand
+from optimise import Line
+from commonline import LineIndex
+
+class RemoveDuplicate(Filter):
+  """ Remove repeated cutting moves
+  """
+
+  def __init__(self, tolerance = 0.001):
+    """ Constructor
+
+      Cuts are treated as the same if their end points are within the
+      tolerance (in mm) of each other.
+    """
+    self.tolerance = tolerance
+    self.x, self.y, self.z = None, None, None
+    self.mx, self.my = None, None
+    self.safe = None
+    self.feed, self.plunge = None, None
+    # Cuts already made
+    self.seen = set()
+    self.lines = LineIndex(tolerance)
+    self.spans = dict()
+    # State of the tool if we have lifted it to skip a cut
+    self.lifted = False
+    self.restoreFeed = False
+    # Set if a plunge is being held back until the next cut
+    self.pending = False
+
+  def _point(self, x, y):
+    """ Quantise a point
+    """
+    return int(round(x / self.tolerance)), int(round(y / self.tolerance))
+
+  def _key(self, command, tx, ty):
+    """ Generate the hash key for a cutting move
+
+      The key is the same regardless of the direction of the cut.
+    """
+    depth = int(round(self.z / self.tolerance))
+    start, end = self._point(self.x, self.y), self._point(tx, ty)
+    if command.command == "G01":
+      return depth, min(start, end), max(start, end)
+    centre = self._point(self.x + (command.I or 0.0), self.y + (command.J or 0.0))
+    clockwise = command.command == "G02"
+    if start == end:
+      # Full circle, the direction doesn't matter
+      clockwise = None
+    elif end < start:
+      start, end, clockwise = end, start, not clockwise
+    return depth, start, end, centre, clockwise
+
+  def _uncovered(self, key, t1, t2):
+    """ Find the parts of the span t1 -> t2 on a line that haven't been cut
+
+      The span is then marked as cut. Returns a list of (start, end) tuples in
+      increasing order.
+    """
+    starts, ends = self.spans.setdefault(key, (list(), list()))
+    pieces = list()
+    position = t1
+    first = bisect_left(ends, t1)
+    last = first
+    while (last < len(starts)) and (starts[last] <= t2):
+      if starts[last] > (position + self.tolerance):
+        pieces.append((position, starts[last]))
+      position = max(position, ends[last])
+      last = last + 1
+    if t2 > (position + self.tolerance):
+      pieces.append((position, t2))
+    # Merge the new span with any it overlaps
+    if last > first:
+      starts[first:last] = [ min(t1, starts[first]) ]
+      ends[first:last] = [ max(t2, ends[last - 1]) ]
+    else:
+      starts.insert(first, t1)
+      ends.insert(first, t2)
+    return pieces
+
+  def _pieces(self, command, tx, ty):
+    """ Determine the sections of a cutting move that need to be made
+
+      Returns None if the full move is needed, otherwise a (possibly empty)
+      list of (x1, y1, x2, y2) tuples.
+    """
+    key = self._key(command, tx, ty)
+    if key in self.seen:
+      return list()
+    self.seen.add(key)
+    if command.command <> "G01":
+      return None
+    # Check for overlaps with other cuts along the same line
+    line, ux, uy = self.lines.find(Line(self.x, self.y, tx, ty))
+    t1 = (ux * self.x) + (uy * self.y)
+    t2 = (ux * tx) + (uy * ty)
+    pieces = self._uncovered((key[0], line), min(t1, t2), max(t1, t2))
+    if (len(pieces) == 1) and (pieces[0] == (min(t1, t2), max(t1, t2))):
+      return None
+    # Convert back to points along the original move (in the same direction)
+    results = list()
+    for a, b in pieces:
+      fa, fb = (a - t1) / (t2 - t1), (b - t1) / (t2 - t1)
+      if fa > fb:
+        fa, fb = fb, fa
+      results.append((fa, fb))
+    results.sort()
+    points = list()
+    for fa, fb in results:
+      points.append(self._along(tx, ty, fa) + self._along(tx, ty, fb))
+    return points
+
+  def _along(self, tx, ty, fraction):
+    """ Get the point at the given fraction along the move to (tx, ty)
+    """
+    if fraction <= 0.0:
+      return self.x, self.y
+    if fraction >= 1.0:
+      return tx, ty
+    return self.x + (fraction * (tx - self.x)), self.y + (fraction * (ty - self.y))
+
+  def _command(self, command, **kwargs):
+    """ Create a new command
+    """
+    result = GCommand()
+    result.command = command
+    for param, value in kwargs.items():
+      setattr(result, param, value)
+    return result
+
+  def _lift(self, results):
+    """ Lift the tool clear of the work
+    """
+    if not self.lifted:
+      results.append(self._command("G00", Z = self.safe))
+      self.lifted = True
+
+  def _moveTo(self, results, x, y):
+    """ Move the tool (at safe height) to the given position
+    """
+    self._lift(results)
+    results.append(self._command("G00", X = x, Y = y))
+    self.mx, self.my = x, y
+
+  def _cutFrom(self, results, x, y):
+    """ Make sure the tool is at the given position and the cutting depth
+
+      The tool is only lowered here, just before a cut that is being kept,
+      so skipped cuts don't leave a plunge followed by a retract behind.
+    """
+    if (self.mx <> x) or (self.my <> y):
+      self._moveTo(results, x, y)
+    if self.lifted:
+      feed = self.plunge or self.feed
+      results.append(self._command("G01", Z = self.z, F = feed))
+      self.lifted, self.pending = False, False
+      self.restoreFeed = (self.feed is not None) and (feed <> self.feed)
+
+  def _emit(self, results, command):
+    """ Add a command to the output making sure the feed rate is correct
+    """
+    if self.restoreFeed and (command.command in ("G01", "G02", "G03")):
+      if command.F is None:
+        command = command.clone()
+        command.F = self.feed
+      self.restoreFeed = False
+    results.append(command)
+
+  def _isCut(self, command, tx, ty):
+    """ Determine if the command is a cutting move in the XY plane
+    """
+    if (self.x is None) or (self.y is None) or (self.z is None) or (self.safe is None):
+      return False
+    if (self.z >= 0.0) or ((command.Z is not None) and (command.Z <> self.z)):
+      return False
+    if command.command == "G01":
+      return (tx <> self.x) or (ty <> self.y)
+    return command.command in ("G02", "G03")
+
+  def apply(self, command):
+    """ Drop (or trim) any cuts that have already been made
+    """
+    tx, ty = self.x, self.y
+    if command.X is not None:
+      tx = command.X
+    if command.Y is not None:
+      ty = command.Y
+    results = list()
+    if command.F is not None:
+      self.feed = command.F
+    if self._isCut(command, tx, ty):
+      pieces = self._pieces(command, tx, ty)
+      if pieces is None:
+        # The full move is needed
+        self._cutFrom(results, self.x, self.y)
+        self._emit(results, command)
+        self.mx, self.my = tx, ty
+      elif len(pieces) == 0:
+        self.pending = False
+        self._lift(results)
+      else:
+        for x1, y1, x2, y2 in pieces:
+          self._cutFrom(results, x1, y1)
+          self._emit(results, self._command("G01", X = x2, Y = y2, F = self.feed))
+          self.restoreFeed = False
+          self.mx, self.my = x2, y2
+        if (self.mx <> tx) or (self.my <> ty):
+          self._lift(results)
+      self.x, self.y = tx, ty
+      return results
+    if self.pending and command.command:
+      # The plunge wasn't for a cut (drilling for example), make it now
+      self._cutFrom(results, self.x, self.y)
+    if (command.X is None) and (command.Y is None):
+      if command.Z is None:
+        # Nothing moves so the tool can stay where it is until it is needed
+        self._emit(results, command)
+        return results
+      height = self.z
+      if self.lifted:
+        height = self.safe
+      if command.Z >= 0.0:
+        # Drop retractions to the height the tool is already at
+        if (command.Z <> height) or (command.F is not None):
+          self._emit(results, command)
+        elif command.comment:
+          results.append(self._command("", comment = command.comment))
+        self.lifted = False
+        self.safe, self.z = command.Z, command.Z
+        return results
+      if (self.safe is not None) and (height == self.safe):
+        # Plunge from safe height, wait for a cut that needs it
+        self.z, self.plunge = command.Z, self.feed
+        self.lifted, self.pending = True, True
+        self.restoreFeed = self.restoreFeed or (command.F is not None)
+        return results
+    # Put the tool back where the original program expects it
+    if self.lifted or (self.mx <> self.x) or (self.my <> self.y):
+      if not self.lifted:
+        # Already clear of the work, only the position needs fixing
+        if (command.X is None) or (command.Y is None):
+          results.append(self._command("G00", X = self.x, Y = self.y))
+      elif (command.Z is not None) and (command.Z >= 0.0):
+        self._moveTo(results, self.x, self.y)
+        self.lifted = False
+      else:
+        self._cutFrom(results, self.x, self.y)
+    self._emit(results, command)
+    # Track the current state
+    if command.Z is not None:
+      if command.Z >= 0.0:
+        self.safe = command.Z
+      elif ((self.z is None) or (command.Z < self.z)) and (command.F is not None):
+        self.plunge = command.F
+      self.z = command.Z
+    self.x, self.y = tx, ty
+    self.mx, self.my = tx, ty
+    return results
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------------
+# 18-Oct-2026 ShaneG
+#
+# Excellon drill file support. This handles the common variations produced
+# by PCB design packages - inch or metric units, leading or trailing zero
+# suppression, explicit decimal points and the FMAT 1 and 2 command sets.
+# Drilled holes are returned as NumPy arrays grouped by diameter.
+#----------------------------------------------------------------------------
+import re
+import numpy as np
+
+#--- Default number of integer and decimal digits for each unit
+FORMATS = {
+  "INCH": (2, 4),
+  "METRIC": (3, 3),
+  }
+
+#--- Patterns for the commands we need
+TOOL_DEFINITION = re.compile(r"^T([0-9]+)[^C]*C([0-9.]+)")
+TOOL_SELECT = re.compile(r"^T([0-9]+)$")
+COORDINATE = re.compile(r"([XY])([+-]?[0-9.]+)")
+FILE_FORMAT = re.compile(r"FILE_FORMAT=([0-9]+):([0-9]+)")
+UNIT_FORMAT = re.compile(r"^(INCH|METRIC)(.*)$")
+
+def parseNumber(text, digits, leading):
+  """ Convert an Excellon co-ordinate to a number
+
+    The digits parameter is a tuple of (integer, decimal) digits. If leading
+    is True leading zeros are present (and trailing zeros may be left out),
+    otherwise trailing zeros are present.
+  """
+  if "." in text:
+    return float(text)
+  sign = 1.0
+  if text[0] in "+-":
+    if text[0] == "-":
+      sign = -1.0
+    text = text[1:]
+  if leading:
+    return sign * (int(text, 10) / float(10 ** (len(text) - digits[0])))
+  return sign * (int(text, 10) / float(10 ** digits[1]))
+
+def loadExcellon(filename, precision = 1):
+  """ Load an Excellon format drill file
+
+    Returns a dictionary mapping drill diameters (in mm, rounded to the given
+    number of decimal places) to an (n, 2) array of X/Y positions (in mm).
+  """
+  units = "INCH"
+  digits = None
+  leading = True
+  header = False
+  tools = dict()
+  holes = dict()
+  current = None
+  x, y = 0.0, 0.0
+  for line in open(filename, "r"):
+    line = line.strip()
+    if line == "":
+      continue
+    # Some packages describe the number format in a comment
+    if line.startswith(";"):
+      match = FILE_FORMAT.search(line)
+      if match is not None:
+        digits = (int(match.group(1)), int(match.group(2)))
+      continue
+    if line == "M48":
+      header = True
+      continue
+    if line in ("%", "M95"):
+      header = False
+      continue
+    # Units and zero suppression (eg "INCH,LZ" or "METRIC,TZ,000.000")
+    match = UNIT_FORMAT.match(line)
+    if match is not None:
+      units = match.group(1)
+      for option in match.group(2).split(","):
+        if option == "LZ":
+          leading = True
+        elif option == "TZ":
+          leading = False
+        elif "." in option:
+          parts = option.split(".")
+          digits = (len(parts[0]), len(parts[1]))
+      continue
+    if line in ("M71", "M72"):
+      # FMAT 1 unit selection
+      units = { "M71": "METRIC", "M72": "INCH" }[line]
+      continue
+    scale = 1.0
+    if units == "INCH":
+      scale = 25.4
+    # Tool definitions (eg "T1C0.039" or "T01F00S00C0.0394")
+    match = TOOL_DEFINITION.match(line)
+    if match is not None:
+      tools[int(match.group(1))] = round(scale * float(match.group(2)), precision)
+    if header:
+      continue
+    # Tool selection (a definition in the body also selects the tool)
+    if match is None:
+      match = TOOL_SELECT.match(line)
+    if match is not None:
+      number = int(match.group(1))
+      current = None
+      if number > 0:
+        if not tools.has_key(number):
+          raise Exception("Undefined tool T%d in '%s'" % (number, filename))
+        current = tools[number]
+        holes.setdefault(current, list())
+      continue
+    if current is None:
+      continue
+    # Drill hits, the co-ordinates are modal
+    if line[0] in "XY":
+      for axis, value in COORDINATE.findall(line):
+        value = scale * parseNumber(value, digits or FORMATS[units], leading)
+        if axis == "X":
+          x = value
+        else:
+          y = value
+      holes[current].append((x, y))
+  # Convert to arrays
+  results = dict()
+  for diam, points in holes.items():
+    if len(points) > 0:
+      results[diam] = np.array(points, dtype = float)
+  return results
+
+def mergeDrills(drills, limit, size):
+  """ Combine all drills up to a given size into a single group
+
+    Returns a new dictionary with all holes with a diameter <= limit moved
+    to the given size.
+  """
+  results = dict()
+  merged = list()
+  for diam in sorted(drills.keys()):
+    if diam <= limit:
+      merged.append(drills[diam])
+    else:
+      results[diam] = drills[diam]
+  if len(merged) > 0:
+    if results.has_key(size):
+      merged.append(results[size])
+    results[size] = np.concatenate(merged)
+  return results
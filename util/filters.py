@@ -4,7 +4,7 @@
 #
 # A simple set of filters.
 #----------------------------------------------------------------------------
-from gcode import Filter, GCommand
+from gcode import Filter, GCommand, PARAMS
 from math import sin, cos, radians
 
 class SwapXY(Filter):
@@ -157,3 +157,279 @@ class FeedRate(Filter):
         command.F = self.cutting
     return command
 
+
+class RemoveRedundant(Filter):
+  """ Remove commands that have no effect on the machine
+
+    This removes feed rates that are already in effect, moves that don't go
+    anywhere and retractions that are immediately followed by an insertion
+    at the same position.
+  """
+
+  def __init__(self):
+    self.x, self.y, self.z = None, None, None
+    self.feed = None
+    self.pending = None
+    self.held = None
+    self.heldz = None
+
+  def _release(self):
+    """ Return the held retraction (if any) as a list of commands
+    """
+    if self.held is None:
+      return list()
+    results = [ self._emit(self.held) ]
+    self.held = None
+    return results
+
+  def _emit(self, command):
+    """ Update the modal state for a command that is being kept
+    """
+    if command.command in ("G01", "G02", "G03"):
+      if (command.F is None) and (self.pending is not None):
+        command = command.clone()
+        command.F = self.pending
+      self.pending = None
+    if command.F is not None:
+      if command.F == self.feed:
+        command = command.clone()
+        command.F = None
+      else:
+        self.feed = command.F
+    return command
+
+  def _isMoveTo(self, command, x, y, z):
+    """ Determine if the command is a straight move to the given position
+    """
+    if command.command not in ("G00", "G01"):
+      return False
+    if (command.X is None) and (command.Y is None) and (command.Z is None):
+      return False
+    for p in ("I", "J", "K", "R", "P"):
+      if getattr(command, p) is not None:
+        return False
+    for value, current in ((command.X, x), (command.Y, y), (command.Z, z)):
+      if (value is not None) and (value <> current):
+        return False
+    return True
+
+  def _setFeed(self, command):
+    """ Keep the effect of the feed rate on a command that is dropped
+    """
+    if (command.F is not None) and (command.F <> self.feed):
+      self.pending = command.F
+
+  def apply(self, command):
+    # Comments can pass a held retraction
+    if command.command == "":
+      if not [ p for p in PARAMS if getattr(command, p) is not None ]:
+        return command
+    if command.command not in ("G00", "G01", "G02", "G03"):
+      results = self._release()
+      results.append(self._emit(command))
+      return results
+    if command.comment == "":
+      # Insertion directly after a retraction at the same position
+      if (self.held is not None) and (command.command == "G01") and self._isMoveTo(command, self.x, self.y, self.heldz):
+        self._setFeed(command)
+        self.held = None
+        self.z = self.heldz
+        return None
+      # Moves that don't go anywhere
+      if self._isMoveTo(command, self.x, self.y, self.z):
+        self._setFeed(command)
+        return None
+    results = self._release()
+    # Hold back retractions until we see what follows
+    if (command.command == "G00") and (command.comment == "") and (command.X is None) and (command.Y is None):
+      if (command.Z is not None) and (self.z is not None) and (command.Z > self.z):
+        self.held = command
+        self.heldz = self.z
+        self.z = command.Z
+        return results
+    results.append(self._emit(command))
+    # Track the current position
+    if command.X is not None:
+      self.x = command.X
+    if command.Y is not None:
+      self.y = command.Y
+    if command.Z is not None:
+      self.z = command.Z
+    return results
+
+  def flush(self):
+    """ Return any held retraction
+    """
+    results = self._release()
+    if len(results) == 0:
+      return None
+    return results
+
+class DrillCycle(Filter):
+  """ Replace simple drilling moves with canned cycles
+
+    A rapid move to a position followed by a plunge (G01 with only Z and F)
+    and a rapid retraction is replaced with a G81 cycle (or a G83 peck cycle
+    if a peck depth is given). Following holes with the same depth, feed
+    rate and retraction height only need the X/Y position. Each cycle is
+    preceded by G98 so the tool returns to the initial Z level between holes
+    whatever the controller's default retract mode is.
+  """
+
+  def __init__(self, peck = None):
+    self.peck = peck
+    self.x, self.y = None, None
+    self.feed = None
+    self.held = list()
+    self.cycle = None
+
+  def _release(self):
+    """ End the current cycle and return any held commands
+    """
+    results = list()
+    if self.cycle is not None:
+      end = GCommand()
+      end.command = "G80"
+      results.append(end)
+      self.cycle = None
+    for command in self.held:
+      if command.F is not None:
+        self.feed = command.F
+    results.extend(self.held)
+    self.held = list()
+    return results
+
+  def _hole(self, depth, retract):
+    """ Generate the command for a single hole
+    """
+    result = GCommand()
+    result.X, result.Y = self.x, self.y
+    if self.cycle <> (depth, retract, self.feed):
+      result.command = "G81"
+      if self.peck is not None:
+        result.command = "G83"
+        result.Q = self.peck
+      result.Z, result.R, result.F = depth, retract, self.feed
+      self.cycle = (depth, retract, self.feed)
+    return result
+
+  def _holds(self, command):
+    """ Determine if the command continues the drilling pattern
+    """
+    xy = (command.X is not None) or (command.Y is not None)
+    if len(self.held) == 0:
+      return (command.command == "G00") and xy and (command.Z is None)
+    if len(self.held) == 1:
+      return (command.command == "G01") and (not xy) and (command.Z is not None) and (command.Z < 0.0)
+    return (command.command == "G00") and (not xy) and (command.Z is not None) and (command.Z >= 0.0)
+
+  def apply(self, command):
+    results = list()
+    if not self._holds(command):
+      if (len(self.held) == 0) and (command.command == "") and (command.X is None) and (command.Y is None):
+        # Comments can stay inside the cycle
+        return command
+      results = self._release()
+    if self._holds(command):
+      if len(self.held) == 2:
+        depth = self.held[1].Z
+        if self.held[1].F is not None:
+          self.feed = self.held[1].F
+        self.held = list()
+        if self.cycle is None:
+          mode = GCommand()
+          mode.command = "G98"
+          results.append(mode)
+        results.append(self._hole(depth, command.Z))
+      else:
+        self.held.append(command)
+    else:
+      results.append(command)
+      if command.F is not None:
+        self.feed = command.F
+    # Track the current position
+    if command.X is not None:
+      self.x = command.X
+    if command.Y is not None:
+      self.y = command.Y
+    return results
+
+  def flush(self):
+    results = self._release()
+    if len(results) == 0:
+      return None
+    return results
+
+class LineRun(Filter):
+  """ Base class for filters that work on runs of G01 moves in the XY plane
+
+    Consecutive G01 commands that only move in X/Y (at the same feed rate)
+    are collected and passed to the process() method as a list of points
+    (starting with the position before the run) along with the commands.
+  """
+
+  def __init__(self):
+    self.x, self.y = None, None
+    self.run = list()
+
+  def _canJoin(self, command):
+    """ Determine if the command can be added to the current run
+    """
+    if (command.command <> "G01") or (command.comment <> ""):
+      return False
+    if (command.X is None) and (command.Y is None):
+      return False
+    for p in ("Z", "I", "J", "K", "R"):
+      if getattr(command, p) is not None:
+        return False
+    # The feed rate must stay the same over the run
+    if (len(self.run) > 0) and (command.F is not None) and (command.F <> self.run[0].F):
+      return False
+    return True
+
+  def _flushRun(self):
+    """ Generate the replacement commands for the current run
+    """
+    if len(self.run) == 0:
+      return list()
+    points = [ (self.x, self.y) ]
+    x, y = self.x, self.y
+    for cmd in self.run:
+      if cmd.X is not None:
+        x = cmd.X
+      if cmd.Y is not None:
+        y = cmd.Y
+      points.append((x, y))
+    results = self.process(points, self.run)
+    # Save the end position
+    self.x, self.y = points[-1]
+    self.run = list()
+    return results
+
+  def process(self, points, commands):
+    """ Return the replacement commands for a run
+    """
+    return commands
+
+  def apply(self, command):
+    """ Collect runs of line segments
+    """
+    if (self.x is not None) and (self.y is not None) and self._canJoin(command):
+      self.run.append(command)
+      return None
+    results = self._flushRun()
+    results.append(command)
+    # Track the current position
+    if command.X is not None:
+      self.x = command.X
+    if command.Y is not None:
+      self.y = command.Y
+    return results
+
+  def flush(self):
+    """ Process any remaining segments
+    """
+    results = self._flushRun()
+    if len(results) == 0:
+      return None
+    return results
@@ -5,14 +5,29 @@
 # Reworking the gcode loader and filter process.
 #----------------------------------------------------------------------------
 import re
+import numpy as np
+from operator import itemgetter, attrgetter
+from itertools import izip
 from PIL import Image, ImageDraw
-from math import degrees, atan2, sqrt, sin, cos, radians, pi
+from math import degrees, atan2, sqrt, sin, cos, radians, pi, ceil
 
 # Set up the regular expression for processing G-Code
 REGCODE = re.compile("(([A-Z])((-?[0-9]+)\.?([0-9]+)?))|(\(.*\))")
 
 # Supported parameter words
-PARAMS = ("X", "Y", "Z", "I", "J", "K", "R", "F", "P")
+PARAMS = ("X", "Y", "Z", "I", "J", "K", "R", "F", "P", "Q", "T")
+
+# Parameter words that take whole numbers (these have no units)
+INTEGERS = ("T", )
+
+# Accessors used to format commands in bulk
+VALUES = itemgetter(*PARAMS)
+COMMAND = attrgetter("command")
+COMMENT = attrgetter("comment")
+
+# Output buffering (buffer size in bytes, lines per write)
+WRITE_BUFFER = 1024 * 1024
+WRITE_BATCH = 1024
 
 #----------------------------------------------------------------------------
 # Public classes
@@ -50,7 +65,9 @@ class GCommand:
           self.command = "%s%02.1f" % (parts[0][1], float(parts[0][2]))
         # Process the rest
         for p in parts[1:]:
-          if p[1] in PARAMS:
+          if p[1] in INTEGERS:
+            setattr(self, str(p[1]), int(float(p[2])))
+          elif p[1] in PARAMS:
             setattr(self, str(p[1]), float(p[2]))
 
   def clone(self):
@@ -80,7 +97,10 @@ class GCommand:
     for param in PARAMS:
       p = getattr(self, param)
       if p is not None:
-        result = "%s %s%0.4f" % (result, param, p)
+        if param in INTEGERS:
+          result = "%s %s%d" % (result, param, p)
+        else:
+          result = "%s %s%0.4f" % (result, param, p)
     result = "%s %s" % (result, self.comment)
     return result.strip()
 
@@ -105,6 +125,12 @@ class Filter:
     """
     return command
 
+  def flush(self):
+    """ Called at the end of the command stream. Filters that hold back
+        commands (to look ahead) return the remaining commands here.
+    """
+    return None
+
 class FilterChain(Filter):
   """ A wrapper for a group of filters
   """
@@ -114,11 +140,11 @@ class FilterChain(Filter):
     """
     self.filters = filters
 
-  def apply(self, command):
-    """ Called with a GCommand instance the filter can return None to remove
-        the command, a replacement command or a list of replacements.
+  def _applyFrom(self, index, command):
+    """ Pass a command (or list of commands) through the filters starting at
+        the given index.
     """
-    for f in self.filters:
+    for f in self.filters[index:]:
       if command is None:
         return None
       if isinstance(command, GCommand):
@@ -138,6 +164,197 @@ class FilterChain(Filter):
           command = results
     return command
 
+  def apply(self, command):
+    """ Called with a GCommand instance the filter can return None to remove
+        the command, a replacement command or a list of replacements.
+    """
+    return self._applyFrom(0, command)
+
+  def flush(self):
+    """ Flush each filter in turn, passing anything it was holding through
+        the filters that follow it.
+    """
+    results = list()
+    for index in range(len(self.filters)):
+      response = self._applyFrom(index + 1, self.filters[index].flush())
+      if response is not None:
+        if isinstance(response, GCommand):
+          results.append(response)
+        else:
+          results.extend(response)
+    if len(results) == 0:
+      return None
+    return results
+
+class Words(dict):
+  """ Cache of the text for the values of a single word
+
+    Each value is only formatted the first time it is seen. A value of None
+    (the parameter is not present) or an empty comment produces no text.
+  """
+
+  # Maximum number of values to remember
+  LIMIT = 100000
+
+  def __init__(self, prefix, fmt, compact = False):
+    dict.__init__(self)
+    self.prefix = prefix
+    self.fmt = fmt
+    self.compact = compact
+    self.clear()
+
+  def clear(self):
+    dict.clear(self)
+    self[None] = ""
+    self[""] = ""
+
+  def __missing__(self, value):
+    text = self.fmt % value
+    if self.compact:
+      if "." in text:
+        text = text.rstrip("0").rstrip(".")
+      if text == "-0":
+        text = "0"
+    text = (self.prefix + text).rstrip()
+    # Zero and negative zero are the same key but may format differently
+    if value <> 0:
+      self[value] = text
+    return text
+
+class Writer:
+  """ A writer converts commands back into text when saving
+
+    Commands are formatted in batches, a column at a time. The parameter
+    values are pulled out of every command in one step, parameters that are
+    not used in the batch are skipped and the text for each value comes from
+    a cache built with the writer. The default output is the same as str().
+  """
+
+  # Number formats for each precision
+  FORMATS = dict()
+
+  def __init__(self):
+    self.words = [ Words(" " + param, self._number(param, 4)) for param in PARAMS ]
+    self.comments = Words(" ", "%s")
+    self.reset()
+
+  def _number(self, param, precision):
+    """ Get the format for a single parameter value
+    """
+    if param in INTEGERS:
+      return "%d"
+    if not Writer.FORMATS.has_key(precision):
+      Writer.FORMATS[precision] = "%%0.%df" % precision
+    return Writer.FORMATS[precision]
+
+  def _columns(self, commands):
+    """ Get the text for each parameter used by a list of commands
+
+      Returns a list of (index, words) tuples where the index is the
+      position of the parameter in PARAMS and words is the text for that
+      parameter for each command.
+    """
+    columns = list()
+    values = izip(*map(VALUES, map(vars, commands)))
+    for index, (column, words) in enumerate(izip(values, self.words)):
+      if column.count(None) == len(column):
+        continue
+      if len(words) > Words.LIMIT:
+        words.clear()
+      columns.append((index, map(words.__getitem__, column)))
+    return columns
+
+  def _lines(self, commands, columns):
+    """ Join the command, parameter words and comment for each command
+    """
+    if len(self.comments) > Words.LIMIT:
+      self.comments.clear()
+    names = map(COMMAND, commands)
+    columns.insert(0, names)
+    columns.append(map(self.comments.__getitem__, map(COMMENT, commands)))
+    lines = map("".join, izip(*columns))
+    # Without a command the first word has a leading space
+    if "" in names:
+      for index in [ i for i, name in enumerate(names) if name == "" ]:
+        lines[index] = lines[index].lstrip()
+    return lines
+
+  def reset(self):
+    """ Called before a new file is written
+    """
+    pass
+
+  def format(self, command):
+    """ Return the text for a single command
+    """
+    return str(command)
+
+  def formatLines(self, commands):
+    """ Return the text for a list of commands
+    """
+    if len(commands) == 0:
+      return list()
+    return self._lines(commands, [ words for index, words in self._columns(commands) ])
+
+class CompactWriter(Writer):
+  """ Generate the smallest output possible
+
+    Words that are unchanged from the previous command are left out and
+    trailing zeros are removed from numbers. The number of decimal places can
+    be set for each parameter.
+  """
+
+  # Parameters that remain in effect until changed
+  MODAL = ("X", "Y", "Z", "F")
+
+  # Commands that move the tool
+  MOTION = ("G00", "G01", "G02", "G03", "")
+
+  def __init__(self, precision = 4, axes = None):
+    """ Constructor
+
+      The axes parameter is an optional dictionary mapping parameter names to
+      the number of decimal places to use for them.
+    """
+    Writer.__init__(self)
+    axes = axes or dict()
+    self.words = list()
+    for param in PARAMS:
+      self.words.append(Words(" " + param, self._number(param, axes.get(param, precision)), compact = True))
+    self.modal = [ param in CompactWriter.MODAL for param in PARAMS ]
+
+  def reset(self):
+    self.last = dict()
+
+  def format(self, command):
+    return self.formatLines([ command ])[0]
+
+  def formatLines(self, commands):
+    if len(commands) == 0:
+      return list()
+    motion = np.array(map(CompactWriter.MOTION.__contains__, map(COMMAND, commands)), dtype = bool)
+    columns = list()
+    for index, words in self._columns(commands):
+      if self.modal[index]:
+        # A motion command can leave the word out if the previous command
+        # that used it was also a motion command with the same value. Other
+        # commands (G92 for example) may change the meaning.
+        words = np.array(words, dtype = object)
+        rows = np.flatnonzero(words <> "")
+        texts, moves = words[rows], motion[rows]
+        same = np.empty(len(rows), dtype = bool)
+        same[0] = self.last.get(index) == texts[0]
+        same[1:] = (texts[1:] == texts[:-1]) & moves[:-1]
+        # Remember the value for the next batch
+        if moves[-1]:
+          self.last[index] = texts[-1]
+        else:
+          self.last.pop(index, None)
+        words[rows[same & moves]] = ""
+        words = words.tolist()
+      columns.append(words)
+    return self._lines(commands, columns)
+
 class GCode(Loader):
   """ Represents a gcode file
   """
@@ -199,6 +416,29 @@ class GCode(Loader):
       self.minz = self._minVal(self.minz, cmd.Z)
       self.maxz = self._maxVal(self.maxz, cmd.Z)
 
+  def appendOffset(self, other, dx = 0.0, dy = 0.0):
+    """ Append the commands from another GCode instance, moved by an offset
+
+      This gives the same result as appending other.clone(Translate(dx, dy))
+      without building the intermediate copy.
+    """
+    for cmd in other.lines:
+      cmd = cmd.clone()
+      if cmd.X is not None:
+        cmd.X = cmd.X + dx
+      if cmd.Y is not None:
+        cmd.Y = cmd.Y + dy
+      self.lines.append(cmd)
+    # Update bounds
+    if other.minx is not None:
+      self.minx = self._minVal(self.minx, other.minx + dx)
+      self.maxx = self._maxVal(self.maxx, other.maxx + dx)
+    if other.miny is not None:
+      self.miny = self._minVal(self.miny, other.miny + dy)
+      self.maxy = self._maxVal(self.maxy, other.maxy + dy)
+    self.minz = self._minVal(self.minz, other.minz)
+    self.maxz = self._maxVal(self.maxz, other.maxz)
+
   def parse(self, line):
     """ Parse the line and return a GCommand instance for it
 
@@ -216,7 +456,7 @@ class GCode(Loader):
       if self.units == GCode.INCH:
         for param in PARAMS:
           p = getattr(cmd, param)
-          if p is not None:
+          if (p is not None) and (param not in INTEGERS):
             setattr(cmd, param, p * 25.4)
       if cmd.command == GCode.INCH:
         cmd.command = GCode.MM
@@ -242,6 +482,11 @@ class GCode(Loader):
         else:
           for c in cmd:
             result.append(c)
+    # Collect anything the filters held back
+    cmd = chain.flush()
+    if cmd is not None:
+      for c in cmd:
+        result.append(c)
     # All done
     return result
 
@@ -344,6 +589,61 @@ class GCode(Loader):
     self.append("G0 Z%0.4f" % safe)
     self.append("(end circle)")
 
+  def _command(self, command, **kwargs):
+    """ Create a command directly (without parsing a string)
+    """
+    result = GCommand()
+    result.command = command
+    for param, value in kwargs.items():
+      setattr(result, param, value)
+    return result
+
+  def circles(self, centres, radius, cut, safe, feed = 254.0, penetrate = 127.0, step = 1.0, arcs = False):
+    """ Add commands to cut a circle of the same size around each point
+
+      The centres are given as an (n, 2) array. The points for all the circles
+      are calculated in one go and the commands are built directly rather
+      than being parsed from strings. If arcs is True each circle is a single
+      G02 command, otherwise they are cut as a sequence of straight lines
+      (the same as the circle() method).
+    """
+    centres = np.asarray(centres, dtype = float).reshape((-1, 2))
+    if len(centres) == 0:
+      return
+    if arcs:
+      xs = centres[:, 0:1] + radius
+      ys = centres[:, 1:2]
+    else:
+      # Same step size as circle()
+      diam = 2.0 * pi * radius
+      step = min(step, diam / 16.0)
+      angle = (2 * pi) / (diam / step)
+      angles = np.arange(int(ceil((2 * pi) / angle))) * angle
+      angles = angles[angles < (2 * pi)]
+      # One row of points per circle, finishing back at the start
+      xs = centres[:, 0:1] + (radius * np.append(np.cos(angles), 1.0))
+      ys = centres[:, 1:2] + (radius * np.append(np.sin(angles), 0.0))
+    for index in range(len(centres)):
+      x, y = centres[index]
+      self.lines.append(self._command("", comment = "(begin circle - x: %0.4f, y: %0.4f, r: %0.4f)" % (x, y, radius)))
+      self.lines.append(self._command("G00", Z = safe))
+      self.lines.append(self._command("G00", X = x + radius, Y = y))
+      self.lines.append(self._command("G01", Z = cut, F = penetrate))
+      if arcs:
+        self.lines.append(self._command("G02", X = x + radius, Y = y, I = -radius, J = 0.0, F = feed))
+      else:
+        for px, py in zip(xs[index].tolist(), ys[index].tolist()):
+          self.lines.append(self._command("G01", X = px, Y = py, F = feed))
+      self.lines.append(self._command("G00", Z = safe))
+      self.lines.append(self._command("", comment = "(end circle)"))
+    # Update bounds
+    self.minx = self._minVal(self.minx, float(centres[:, 0].min() - radius))
+    self.maxx = self._maxVal(self.maxx, float(centres[:, 0].max() + radius))
+    self.miny = self._minVal(self.miny, float(centres[:, 1].min() - radius))
+    self.maxy = self._maxVal(self.maxy, float(centres[:, 1].max() + radius))
+    self.minz = self._minVal(self.minz, min(cut, safe))
+    self.maxz = self._maxVal(self.maxz, max(cut, safe))
+
   def __str__(self):
     def floatStr(val):
       if val is not None:
@@ -379,14 +679,21 @@ def loadGCode(filename, *loaders):
     return results[0]
   return results
 
-def saveGCode(filename, gcode, prefix = None, suffix = None):
+def saveGCode(filename, gcode, prefix = None, suffix = None, writer = None):
   """ Save a gcode file
+
+    The optional writer controls how each command is converted to text.
   """
-  with open(filename, "w") as target:
+  if writer is None:
+    writer = Writer()
+  writer.reset()
+  with open(filename, "w", WRITE_BUFFER) as target:
     if prefix is not None:
       target.write(str(prefix).strip() + "\n")
-    for line in gcode.lines:
-      target.write(str(line) + "\n")
+    for start in range(0, len(gcode.lines), WRITE_BATCH):
+      batch = writer.formatLines(gcode.lines[start:start + WRITE_BATCH])
+      batch.append("")
+      target.write("\n".join(batch))
     if suffix is not None:
       target.write(str(suffix).strip() + "\n")
 
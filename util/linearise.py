@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------------
+# 18-Oct-2026 ShaneG
+#
+# Convert arcs (G02/G03) into a sequence of straight lines for controllers
+# that don't handle arc commands consistently. Rather than using a fixed
+# step size the number of segments is chosen so that no chord strays from
+# the true arc by more than a given tolerance.
+#----------------------------------------------------------------------------
+import numpy as np
+from gcode import Filter, GCommand
+from math import atan2, acos, sqrt, ceil, pi
+
+def arcPoints(x, y, cx, cy, tx, ty, clockwise, tolerance):
+  """ Generate the points along an arc
+
+    The arc starts at (x, y), ends at (tx, ty) and is centred on (cx, cy).
+    Returns a pair of arrays with the X and Y co-ordinates of the end of each
+    segment (the start point is not included, the final point is always
+    exactly (tx, ty)).
+  """
+  r = sqrt(((x - cx) ** 2) + ((y - cy) ** 2))
+  start = atan2(y - cy, x - cx)
+  sweep = atan2(ty - cy, tx - cx) - start
+  if clockwise:
+    if sweep >= 0.0:
+      sweep = sweep - (2 * pi)
+  elif sweep <= 0.0:
+    sweep = sweep + (2 * pi)
+  # Largest step that keeps the chord error within tolerance
+  if tolerance < r:
+    step = 2.0 * acos(1.0 - (tolerance / r))
+  else:
+    step = pi / 2
+  count = max(1, int(ceil(abs(sweep) / step)))
+  angles = start + (sweep * (np.arange(1, count + 1) / float(count)))
+  xs = cx + (r * np.cos(angles))
+  ys = cy + (r * np.sin(angles))
+  xs[-1], ys[-1] = tx, ty
+  return xs, ys
+
+class LineariseArc(Filter):
+  """ Replace arc commands with a sequence of G01 moves
+  """
+
+  def __init__(self, tolerance = 0.01):
+    """ Constructor
+
+      The tolerance is the maximum distance (in mm) between any generated
+      line segment and the original arc.
+    """
+    self.tolerance = tolerance
+    self.x, self.y, self.z = 0.0, 0.0, None
+
+  def _linearise(self, command):
+    """ Generate the line segments for an arc command
+    """
+    tx, ty = self.x, self.y
+    if command.X is not None:
+      tx = command.X
+    if command.Y is not None:
+      ty = command.Y
+    if (command.I is None) and (command.J is None):
+      # Only centre format arcs are supported
+      return command
+    cx, cy = self.x + (command.I or 0.0), self.y + (command.J or 0.0)
+    if (cx == self.x) and (cy == self.y):
+      xs, ys = np.array([ tx ]), np.array([ ty ])
+    else:
+      xs, ys = arcPoints(self.x, self.y, cx, cy, tx, ty, command.command == "G02", self.tolerance)
+    # Interpolate Z for helical moves
+    zs = None
+    if (command.Z is not None) and (self.z is not None):
+      zs = self.z + ((command.Z - self.z) * (np.arange(1, len(xs) + 1) / float(len(xs))))
+    results = list()
+    for index in range(len(xs)):
+      line = GCommand()
+      line.command = "G01"
+      line.X = float(xs[index])
+      line.Y = float(ys[index])
+      if zs is not None:
+        line.Z = float(zs[index])
+      elif index == 0:
+        line.Z = command.Z
+      results.append(line)
+    # The feed rate and comment belong on the first move
+    results[0].F = command.F
+    results[0].comment = command.comment
+    return results
+
+  def apply(self, command):
+    """ Convert arcs into lines
+    """
+    result = command
+    if command.command in ("G02", "G03"):
+      result = self._linearise(command)
+    # Track the current position
+    if command.X is not None:
+      self.x = command.X
+    if command.Y is not None:
+      self.y = command.Y
+    if command.Z is not None:
+      self.z = command.Z
+    return result
@@ -5,6 +5,7 @@
 # Some linegrinder specific filters.
 #----------------------------------------------------------------------------
 from subprocess import Popen, PIPE
+from os.path import abspath, isfile
 
 # File name suffix (as generated by linegrinder)
 SUFFIX = (
@@ -92,9 +93,12 @@ def getBoardSize(name):
               max_y = max(max_y, val)
   return (min_x, min_y, max_x - min_x, max_y - min_y)
 
-def generateDrillFile(name):
+def generateDrillFile(name, canned = False):
   """ Generate the drill file from the pad touch downs in the isolation
       routing file.
+
+      If canned is True the holes are drilled with a G81 cycle (returning to
+      the initial Z level between holes).
   """
   data = None
   with open(getCodeFile(name, 0), "r") as f:
@@ -122,10 +126,17 @@ def generateDrillFile(name):
   if len(points) == 0:
     return None
   data = list(DRILL_PREFIX)
-  for p in points:
-    data.append("G00 X%s Y%s" % p)
-    data.append("G01 Z-0.118 F5") # TODO: Should allow drill depth to be set
-    data.append("G00 Z0.25") # TODO: Same for safe distance
+  if canned:
+    data.append("G98 (Return to initial Z after each hole)")
+    data.append("G81 X%s Y%s Z-0.118 R0.25 F5" % points[0]) # TODO: See below
+    for p in points[1:]:
+      data.append("X%s Y%s" % p)
+    data.append("G80")
+  else:
+    for p in points:
+      data.append("G00 X%s Y%s" % p)
+      data.append("G01 Z-0.118 F5") # TODO: Should allow drill depth to be set
+      data.append("G00 Z0.25") # TODO: Same for safe distance
   data.extend(DRILL_SUFFIX)
   return list([ line + "\n" for line in data ])
 
@@ -73,5 +73,29 @@ class Logger:
     self.write(datetime.now(), Logger.MSG_FATAL, message)
     exit(1)
 
+class BufferedLogger(Logger):
+  """ A logger that keeps the messages so they can be written later
+
+    This is used in worker processes so that their output can be written by
+    the parent without being mixed up with the output from other workers.
+  """
+
+  def __init__(self, severity = 0):
+    Logger.__init__(self, severity)
+    self.messages = list()
+
+  def write(self, timestamp, severity, message):
+    """ Save the message
+    """
+    self.messages.append((severity, message))
+
+  def replay(self, logger):
+    """ Write the saved messages to another logger
+    """
+    for severity, message in self.messages:
+      if severity >= logger.severity:
+        logger.write(datetime.now(), severity, message)
+    self.messages = list()
+
 LOG = Logger()
 
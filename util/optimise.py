@@ -99,15 +99,15 @@ def getClosest(candidates, x, y):
   del candidates[best_index]
   return candidates, best_item
 
-def optimise(source):
-  """ Return an optimised copy of the given gcode
+def getMovements(source):
+  """ Break the gcode up into individual cutting movements
+
+    Returns a tuple of (movements, insert_feed, feed, airtime) where the
+    movements are Point, Line or Arc instances.
   """
-  # Build up a sequence of cutting operations
   x, y, z = 0.0, 0.0, 0.0
-  cut, safe = source.minz, source.maxz
   insert_feed = 250
   feed = 500
-  prefix = list()
   movements = list()
   airtime = 0.0
   insert = False
@@ -115,7 +115,9 @@ def optimise(source):
   for cmd in source.lines:
     # Look for insertion or retraction. Note that we assume that these moves
     # only change the Z axis
-    nz = cmd.Z or z
+    nz = z
+    if cmd.Z is not None:
+      nz = cmd.Z
     if (nz < 0.0) and (z >= 0.0):
       z = nz
       insert = True
@@ -131,8 +133,11 @@ def optimise(source):
         insert = False
       continue
     # Figure out the new position
-    nx = cmd.X or x
-    ny = cmd.Y or y
+    nx, ny = x, y
+    if cmd.X is not None:
+      nx = cmd.X
+    if cmd.Y is not None:
+      ny = cmd.Y
     if cutting:
       if cmd.command == "G01":
         # Line
@@ -147,9 +152,19 @@ def optimise(source):
       airtime = airtime + distance(x, y, nx, ny)
     # Update position
     x, y = nx, ny
-  LOG.INFO("    Original - %d operations, %dmm air travel" % (len(movements), int(airtime)))
+  return movements, insert_feed, feed, airtime
+
+def optimise(source, log = LOG):
+  """ Return an optimised copy of the given gcode
+
+    Progress is reported through the given logger.
+  """
+  # Build up a sequence of cutting operations
+  cut, safe = source.minz, source.maxz
+  movements, insert_feed, feed, airtime = getMovements(source)
+  log.INFO("    Original - %d operations, %dmm air travel" % (len(movements), int(airtime)))
   if len(movements) == 0:
-    LOG.INFO("    No optimisation can be performed.")
+    log.INFO("    No optimisation can be performed.")
     return source
   # Now generate an optimised order of operations
   x, y, nair = 0.0, 0.0, 0.0
@@ -177,5 +192,5 @@ def optimise(source):
   # Retract
   optimised.append("G00 Z%0.4f" % safe)
   # See what we came up with
-  LOG.INFO("    Optimised - %dmm air travel, %d %% of original." % (int(nair), int((100.0 * nair) / airtime)))
+  log.INFO("    Optimised - %dmm air travel, %d %% of original." % (int(nair), int((100.0 * nair) / airtime)))
   return optimised
@@ -23,7 +23,8 @@ def getSettings(control, options):
     defaults which will be updated from the other sources if they are available.
 
     The function also populates the 'prefix' and 'suffix' control options with
-    the globally defined GCode prefix and suffix
+    the globally defined GCode prefix and suffix and the 'precision' option
+    with the number of decimal places to use for compact output.
   """
   # Load the configuration
   cfgfile = join(dirname(dirname(realpath(__file__))), "gcode.json")
@@ -50,6 +51,7 @@ def getSettings(control, options):
         insertions[k] = str(control[k])
     control['prefix'] = Template("\n".join(config.get("prefix", ( "", )))).safe_substitute(insertions)
     control['suffix'] = Template("\n".join(config.get("suffix", ( "", )))).safe_substitute(insertions)
+    control['precision'] = config.get("precision", dict())
   # Done
   return control
 
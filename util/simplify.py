@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------------
+# 18-Oct-2026 ShaneG
+#
+# Polyline simplification. Generated tool paths often contain long runs of
+# tiny, almost collinear steps. This filter removes any points that can be
+# dropped without moving the path by more than a given tolerance (using the
+# Douglas-Peucker algorithm).
+#----------------------------------------------------------------------------
+import numpy as np
+from filters import LineRun
+
+def simplifyPoints(points, tolerance):
+  """ Simplify a polyline
+
+    The points are given as an (n, 2) array. Returns a boolean array with an
+    entry for each point indicating whether it should be kept. The first and
+    last points are always kept.
+  """
+  points = np.asarray(points, dtype = float)
+  keep = np.zeros(len(points), dtype = bool)
+  keep[0] = True
+  keep[-1] = True
+  pending = [ (0, len(points) - 1) ]
+  while len(pending) > 0:
+    start, end = pending.pop()
+    if (end - start) < 2:
+      continue
+    # Distance from each intermediate point to the segment start -> end
+    origin = points[start]
+    segment = points[end] - origin
+    offsets = points[start + 1:end] - origin
+    length = np.dot(segment, segment)
+    if length > 0.0:
+      t = np.clip(np.dot(offsets, segment) / length, 0.0, 1.0)
+      offsets = offsets - (t[:, np.newaxis] * segment)
+    distances = np.hypot(offsets[:, 0], offsets[:, 1])
+    index = np.argmax(distances)
+    if distances[index] > tolerance:
+      index = start + 1 + index
+      keep[index] = True
+      pending.append((start, index))
+      pending.append((index, end))
+  return keep
+
+class Simplify(LineRun):
+  """ Remove redundant points from runs of G01 moves
+  """
+
+  def __init__(self, tolerance = 0.005):
+    """ Constructor
+
+      The tolerance is the maximum distance (in mm) the simplified path may
+      stray from the original.
+    """
+    LineRun.__init__(self)
+    self.tolerance = tolerance
+
+  def process(self, points, commands):
+    """ Drop any commands that are not needed to stay within tolerance
+    """
+    if len(commands) < 2:
+      return commands
+    keep = simplifyPoints(points, self.tolerance)
+    results = list()
+    for index, cmd in enumerate(commands):
+      if not keep[index + 1]:
+        continue
+      # The dropped moves may have set the axis we need so be explicit
+      cmd = cmd.clone()
+      cmd.X, cmd.Y = points[index + 1]
+      results.append(cmd)
+    # Make sure the feed rate set by the run is preserved
+    if (results[0].F is None) and (commands[0].F is not None):
+      results[0].F = commands[0].F
+    return results
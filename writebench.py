@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#----------------------------------------------------------------------------
+# 18-Oct-2026 ShaneG
+#
+# Measure how long it takes to write a g-code file with each writer.
+#----------------------------------------------------------------------------
+from sys import argv
+from time import time
+from math import sin, pi
+from optparse import OptionParser
+from os import remove, stat, close
+from tempfile import mkstemp
+from util import GCode, Writer, CompactWriter, loadGCode, saveGCode
+
+#--- Usage information
+USAGE = """
+Usage:
+       %s [--lines count] [--repeat count] [filename]
+
+Where:
+
+  --lines  count    number of lines to generate if no file is given
+  --repeat count    number of times to write each file (the best is shown)
+"""
+
+def samplePath(count):
+  """ Generate a program that looks like an isolation routing file
+  """
+  gcode = GCode()
+  gcode.append("G21 (Use mm)")
+  gcode.append("G00 Z3.0000")
+  while len(gcode.lines) < count:
+    x, y = (len(gcode.lines) % 97) * 1.27, (len(gcode.lines) % 89) * 1.27
+    gcode.append("(Track)")
+    gcode.append("G00 X%0.4f Y%0.4f" % (x, y))
+    gcode.append("G01 Z-0.1000 F127.0000")
+    for step in range(40):
+      angle = step * pi / 20.0
+      gcode.append("G01 X%0.4f Y%0.4f F254.0000" % (x + (step * 0.254), y + sin(angle)))
+    gcode.append("G02 X%0.4f Y%0.4f I0.5000 J0.0000" % (x + 10.16, y))
+    gcode.append("G00 Z3.0000")
+  return gcode
+
+def saveOriginal(filename, gcode):
+  """ Write one line at a time through str() (as saveGCode used to)
+  """
+  with open(filename, "w") as target:
+    for line in gcode.lines:
+      target.write(str(line) + "\n")
+
+def measure(repeat, method, *args):
+  """ Return the best time (in seconds) for the given method
+  """
+  best = None
+  for attempt in range(repeat):
+    start = time()
+    method(*args)
+    elapsed = time() - start
+    if (best is None) or (elapsed < best):
+      best = elapsed
+  return best
+
+#--- Main program
+if __name__ == "__main__":
+  # Set up program options
+  parser = OptionParser()
+  parser.add_option("-l", "--lines", action="store", type="int", dest="lines", default=69000)
+  parser.add_option("-r", "--repeat", action="store", type="int", dest="repeat", default=5)
+  options, args = parser.parse_args()
+  # Check positional arguments
+  if len(args) > 1:
+    print USAGE.strip() % argv[0]
+    exit(1)
+  if len(args) == 1:
+    gcode = loadGCode(args[0])
+  else:
+    gcode = samplePath(options.lines)
+  handle, filename = mkstemp(suffix = ".ngc")
+  close(handle)
+  print "Writing %d lines (best of %d)" % (len(gcode.lines), options.repeat)
+  try:
+    baseline = measure(options.repeat, saveOriginal, filename, gcode)
+    size = stat(filename).st_size
+    print "  str() per line  %0.3fs %9d bytes" % (baseline, size)
+    for name, writer in (("Writer", Writer), ("CompactWriter", CompactWriter)):
+      elapsed = measure(options.repeat, lambda: saveGCode(filename, gcode, writer = writer()))
+      print "  %-15s %0.3fs %9d bytes (%0.1fx faster, %d%% of the size)" % (name, elapsed, stat(filename).st_size, baseline / elapsed, (100 * stat(filename).st_size) / size)
+  finally:
+    remove(filename)